@@ -8,9 +8,32 @@ from .models import RegistrationProfile
 User = get_user_model()
 
 
+class ActivationStatusListFilter(admin.SimpleListFilter):
+    title = _("activation status")
+    parameter_name = "status"
+
+    def lookups(self, request, model_admin):
+        return (
+            ("pending", _("Pending")),
+            ("expired", _("Expired")),
+            ("activated", _("Activated")),
+        )
+
+    def queryset(self, request, queryset):
+        match self.value():
+            case "pending":
+                return queryset & RegistrationProfile.objects.pending()
+            case "expired":
+                return queryset & RegistrationProfile.objects.expired()
+            case "activated":
+                return queryset.filter(activated=True)
+        return queryset
+
+
 class RegistrationAdmin(admin.ModelAdmin):
     actions = ["activate_users", "resend_activation_email"]
-    list_display = ("user", "activation_key_expired")
+    list_display = ("user", "expires_at", "activation_key_expired")
+    list_filter = (ActivationStatusListFilter,)
     raw_id_fields = ["user"]
     search_fields = (
         f"user__{User.USERNAME_FIELD}",
@@ -28,7 +51,9 @@ class RegistrationAdmin(admin.ModelAdmin):
 
         site = get_current_site(request)
         for profile in queryset:
-            RegistrationProfile.objects.activate_user(profile.activation_key, site)
+            RegistrationProfile.objects.activate_user(
+                profile.get_activation_key(), site
+            )
 
     @admin.action(description=_("Re-send activation emails"))
     def resend_activation_email(self, request, queryset):
@@ -43,11 +68,9 @@ class RegistrationAdmin(admin.ModelAdmin):
         """
 
         site = get_current_site(request)
-        for profile in queryset:
-            user = profile.user
-            RegistrationProfile.objects.resend_activation_mail(
-                user.email, site, request
-            )
+        RegistrationProfile.objects.resend_activation_mails(
+            queryset.select_related("user"), site, request
+        )
 
 
 admin.site.register(RegistrationProfile, RegistrationAdmin)
@@ -0,0 +1,129 @@
+"""
+An append-only archive of the expired registrations deleted by the
+``cleanupregistration --archive`` command.
+
+The archive is written in JSON Lines, or in CSV when its path ends with
+``.csv`` or ``.csv.gz``, and gzip compressed when its path ends with
+``.gz``. Each batch is written, flushed and synced to disk before it is
+deleted, as a gzip member of its own when compressed, and the length of the
+archive is then recorded in a ``.offset`` file next to it.
+
+An interrupted run is resumed by the next one: the archive is first cut back
+to its recorded length, dropping a batch which was not completely written.
+A recorded length beyond the end of the archive, left by an archive which
+was rotated, is reset.
+A batch archived whose deletion was interrupted is archived again, so
+readers should drop the records whose profile ``id`` they already saw.
+
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def get_archive_fields():
+    """
+    Return the fields of ``RegistrationProfile.objects.values()`` archived
+    for each deleted registration: the profile and its user, but the
+    password.
+    """
+    user_fields = [
+        f"user__{field.attname}"
+        for field in get_user_model()._meta.concrete_fields
+        if not field.primary_key and field.name != "password"
+    ]
+    return ["id", "user_id", "activated", "expires_at", "last_sent_at", *user_fields]
+
+
+class RegistrationArchive:
+    """
+    The archive of expired registrations at ``path``, holding ``fields``.
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        self.compressed = path.endswith(".gz")
+        self.format = "csv" if path.removesuffix(".gz").endswith(".csv") else "jsonl"
+        self.offset_path = f"{path}.offset"
+        self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """
+        Open the archive, cutting it back to the length recorded by the
+        last batch written completely.
+        """
+        self._file = open(self.path, "ab")
+        try:
+            size = self._file.tell()
+            try:
+                with open(self.offset_path) as offset_file:
+                    offset = int(offset_file.read())
+            except FileNotFoundError:
+                offset = size
+            if offset > size:
+                # The offset of an archive since rotated or removed: this
+                # one is new.
+                offset = size
+                self._save_offset(offset)
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._file.close()
+
+    def write(self, rows):
+        """
+        Append ``rows``, an iterable of dictionaries, to the archive and sync
+        it to disk. Return the number of rows written.
+        """
+        empty = self._file.tell() == 0
+        stream = self._file
+        if self.compressed:
+            stream = gzip.GzipFile(fileobj=self._file, mode="wb")
+        text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        count = 0
+        if self.format == "csv":
+            writer = csv.DictWriter(text, self.fields)
+            if empty:
+                writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                text.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+                count += 1
+        text.flush()
+        text.detach()
+        if self.compressed:
+            # Writes the gzip trailer, leaving the archive open.
+            stream.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._save_offset(self._file.tell())
+        return count
+
+    def _save_offset(self, offset):
+        temp_path = f"{self.offset_path}.tmp"
+        with open(temp_path, "w") as offset_file:
+            offset_file.write(str(offset))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.replace(temp_path, self.offset_path)
@@ -1,9 +1,14 @@
 from django.contrib.sites.shortcuts import get_current_site
 
+from asgiref.sync import sync_to_async
+
 from ... import signals
 from ...models import SupervisedRegistrationProfile
 from ...views import BaseApprovalView
+from ...views import BaseAsyncApprovalView
 from ..default.views import ActivationView as BaseActivationView
+from ..default.views import AsyncActivationView as BaseAsyncActivationView
+from ..default.views import AsyncResendActivationView as BaseAsyncResendActivationView
 from ..default.views import RegistrationView as BaseRegistrationView
 from ..default.views import ResendActivationView as BaseResendActivationView
 
@@ -32,6 +37,18 @@ class ActivationView(BaseActivationView):
     registration_profile = SupervisedRegistrationProfile
 
 
+class AsyncActivationView(BaseAsyncActivationView):
+
+    """
+    Follows the exact logic of
+    ``registration.backends.default.views.AsyncActivationView`` but uses
+    ``SupervisedRegistrationProfile`` instead of ``RegistrationProfile``
+
+    """
+
+    registration_profile = SupervisedRegistrationProfile
+
+
 class ResendActivationView(BaseResendActivationView):
 
     """
@@ -44,6 +61,18 @@ class ResendActivationView(BaseResendActivationView):
     registration_profile = SupervisedRegistrationProfile
 
 
+class AsyncResendActivationView(BaseAsyncResendActivationView):
+
+    """
+    Follows the exact logic of
+    ``registration.backends.default.views.AsyncResendActivationView`` but uses
+    ``SupervisedRegistrationProfile`` instead of ``RegistrationProfile``
+
+    """
+
+    registration_profile = SupervisedRegistrationProfile
+
+
 class ApprovalView(BaseApprovalView):
     def approve(self, *args, **kwargs):
         """
@@ -68,3 +97,23 @@ class ApprovalView(BaseApprovalView):
 
     def get_success_url(self, user):
         return ("registration_approve_complete", (), {})
+
+
+class AsyncApprovalView(BaseAsyncApprovalView, ApprovalView):
+    """
+    Follows the exact logic of ``ApprovalView``, but awaits the approval,
+    for deployments served over ASGI.
+
+    """
+
+    async def aapprove(self, *args, **kwargs):
+        user_id = kwargs.get("profile_id", "")
+        site = await sync_to_async(get_current_site)(self.request)
+        approved_user = await SupervisedRegistrationProfile.objects.aadmin_approve_user(
+            user_id, site
+        )
+        if approved_user:
+            await sync_to_async(signals.user_approved.send)(
+                sender=self.__class__, user=approved_user, request=self.request
+            )
+        return approved_user
@@ -3,9 +3,13 @@ from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
 from django.shortcuts import render
 
+from asgiref.sync import sync_to_async
+
 from ... import signals
 from ...models import RegistrationProfile
 from ...views import BaseActivationView
+from ...views import BaseAsyncActivationView
+from ...views import BaseAsyncResendActivationView
 from ...views import BaseRegistrationView
 from ...views import BaseResendActivationView
 
@@ -102,6 +106,7 @@ class RegistrationView(BaseRegistrationView):
             site=site,
             send_email=self.SEND_ACTIVATION_EMAIL,
             request=self.request,
+            activation_window=self.get_activation_window(new_user_instance),
         )
         signals.user_registered.send(
             sender=self.__class__, user=new_user, request=self.request
@@ -111,6 +116,18 @@ class RegistrationView(BaseRegistrationView):
 
         return new_user
 
+    def get_activation_window(self, user):
+        """
+        Return the ``datetime.timedelta`` during which ``user`` may activate
+        their account, or ``None`` to use the ``ACCOUNT_ACTIVATION_DAYS``
+        setting.
+
+        Override this to give risky signups a short window, or invited users
+        a longer one.
+
+        """
+        return None
+
     def registration_allowed(self):
         """
         Indicate whether account registration is currently permitted,
@@ -156,6 +173,26 @@ class ActivationView(BaseActivationView):
         return ("registration_activation_complete", (), {})
 
 
+class AsyncActivationView(BaseAsyncActivationView, ActivationView):
+    """
+    Follows the exact logic of ``ActivationView``, but awaits the
+    activation, for deployments served over ASGI.
+
+    """
+
+    async def aactivate(self, *args, **kwargs):
+        activation_key = kwargs.get("activation_key", "")
+        site = await sync_to_async(get_current_site)(self.request)
+        user, activated = await self.registration_profile.objects.aactivate_user(
+            activation_key, site
+        )
+        if activated:
+            await sync_to_async(signals.user_activated.send)(
+                sender=self.__class__, user=user, request=self.request
+            )
+        return user
+
+
 class ResendActivationView(BaseResendActivationView):
     registration_profile = RegistrationProfile
 
@@ -185,3 +222,18 @@ class ResendActivationView(BaseResendActivationView):
         return render(
             self.request, "registration/resend_activation_complete.html", context
         )
+
+
+class AsyncResendActivationView(BaseAsyncResendActivationView, ResendActivationView):
+    """
+    Follows the exact logic of ``ResendActivationView``, but awaits the
+    resend, for deployments served over ASGI.
+
+    """
+
+    async def aresend_activation(self, form):
+        site = await sync_to_async(get_current_site)(self.request)
+        email = form.cleaned_data["email"]
+        return await self.registration_profile.objects.aresend_activation_mail(
+            email, site, self.request
+        )
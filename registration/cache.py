@@ -0,0 +1,256 @@
+"""
+Cache helpers sparing the database the lookups of activation keys which are
+known to be invalid, and the activations which were already processed.
+
+They use the Django cache named by the ``REGISTRATION_CACHE`` setting and do
+nothing when that setting is not defined. A ``LocMemCache`` gives a bounded,
+per-process LRU cache; a shared backend (Memcached, Redis, ...) lets every
+process benefit from the misses recorded by the others.
+
+The helpers prefixed with ``a`` are their asynchronous versions, for the
+asynchronous manager methods and views, using the asynchronous cache API.
+
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+ABSORBED_ACTIVATIONS_KEY = "registration:absorbed_activations"
+
+
+def get_cache():
+    """
+    Return the cache used by the registration app, or ``None`` if caching
+    is disabled.
+    """
+    alias = getattr(settings, "REGISTRATION_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def make_key(prefix, value):
+    """
+    Build a cache key for an arbitrary string, e.g. an activation key coming
+    from a URL, which is safe for every cache backend.
+    """
+    digest = hashlib.sha256(value.encode()).hexdigest()
+    return f"registration:{prefix}:{digest}"
+
+
+def is_unknown_activation_key(activation_key):
+    """
+    Return ``True`` if ``activation_key`` recently failed to match any
+    ``RegistrationProfile``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return False
+    return cache.get(make_key("unknown", activation_key), False)
+
+
+async def ais_unknown_activation_key(activation_key):
+    """
+    Asynchronous version of ``is_unknown_activation_key``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return False
+    return await cache.aget(make_key("unknown", activation_key), False)
+
+
+def remember_unknown_activation_key(activation_key):
+    """
+    Record that ``activation_key`` does not match any ``RegistrationProfile``
+    for ``REGISTRATION_NEGATIVE_CACHE_TIMEOUT`` seconds.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    timeout = getattr(settings, "REGISTRATION_NEGATIVE_CACHE_TIMEOUT", 300)
+    cache.set(make_key("unknown", activation_key), True, timeout)
+
+
+async def aremember_unknown_activation_key(activation_key):
+    """
+    Asynchronous version of ``remember_unknown_activation_key``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    timeout = getattr(settings, "REGISTRATION_NEGATIVE_CACHE_TIMEOUT", 300)
+    await cache.aset(make_key("unknown", activation_key), True, timeout)
+
+
+def get_activation_outcome(activation_key):
+    """
+    Return the outcome recorded by ``remember_activation_outcome`` for
+    ``activation_key``: the URL the user was redirected to, an empty string
+    if the activation failed, or ``None`` if nothing was recorded.
+
+    Every hit also increments the counter returned by
+    ``get_absorbed_activation_count``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    outcome = cache.get(make_key("outcome", activation_key))
+    if outcome is not None:
+        cache.add(ABSORBED_ACTIVATIONS_KEY, 0, None)
+        cache.incr(ABSORBED_ACTIVATIONS_KEY)
+    return outcome
+
+
+async def aget_activation_outcome(activation_key):
+    """
+    Asynchronous version of ``get_activation_outcome``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    outcome = await cache.aget(make_key("outcome", activation_key))
+    if outcome is not None:
+        await cache.aadd(ABSORBED_ACTIVATIONS_KEY, 0, None)
+        await cache.aincr(ABSORBED_ACTIVATIONS_KEY)
+    return outcome
+
+
+def remember_activation_outcome(activation_key, outcome):
+    """
+    Record the outcome of the activation of ``activation_key`` for
+    ``REGISTRATION_ACTIVATION_OUTCOME_TIMEOUT`` seconds, so requesting the
+    activation link again (as link-prefetching mail scanners do) is answered
+    without activating again.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    timeout = getattr(settings, "REGISTRATION_ACTIVATION_OUTCOME_TIMEOUT", 60)
+    cache.set(make_key("outcome", activation_key), outcome, timeout)
+
+
+async def aremember_activation_outcome(activation_key, outcome):
+    """
+    Asynchronous version of ``remember_activation_outcome``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    timeout = getattr(settings, "REGISTRATION_ACTIVATION_OUTCOME_TIMEOUT", 60)
+    await cache.aset(make_key("outcome", activation_key), outcome, timeout)
+
+
+def get_absorbed_activation_count():
+    """
+    Return how many activation requests were answered from the cache.
+    """
+    cache = get_cache()
+    if cache is None:
+        return 0
+    return cache.get(ABSORBED_ACTIVATIONS_KEY, 0)
+
+
+def get_token_bucket(prefix, value):
+    """
+    Return the cache key of the bucket of ``value`` in the current window,
+    its ``capacity`` and its ``period``.
+
+    Buckets hold ``capacity`` tokens per window of ``period`` seconds, where
+    ``REGISTRATION_RESEND_RATE`` is ``(capacity, period)``, ``(5, 3600)`` by
+    default.
+    """
+    capacity, period = getattr(settings, "REGISTRATION_RESEND_RATE", (5, 3600))
+    window = int(time.time() // period)
+    return f"{make_key(prefix, value)}:{window}", capacity, period
+
+
+def has_token(prefix, value):
+    """
+    Return whether the bucket of ``value`` has a token left, without taking
+    it.
+    """
+    cache = get_cache()
+    if cache is None:
+        return True
+    key, capacity, period = get_token_bucket(prefix, value)
+    return cache.get(key, 0) < capacity
+
+
+async def ahas_token(prefix, value):
+    """
+    Asynchronous version of ``has_token``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return True
+    key, capacity, period = get_token_bucket(prefix, value)
+    return await cache.aget(key, 0) < capacity
+
+
+def take_token(prefix, value):
+    """
+    Take a token from the bucket of ``value`` and return ``True``, or return
+    ``False`` if the bucket is empty.
+
+    Tokens are counted with the atomic ``add`` and ``incr`` of the cache, so
+    concurrent requests cannot take the same token.
+    """
+    cache = get_cache()
+    if cache is None:
+        return True
+    key, capacity, period = get_token_bucket(prefix, value)
+    cache.add(key, 0, period)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # The counter was evicted between ``add`` and ``incr``.
+        cache.add(key, 1, period)
+        count = 1
+    return count <= capacity
+
+
+async def atake_token(prefix, value):
+    """
+    Asynchronous version of ``take_token``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return True
+    key, capacity, period = get_token_bucket(prefix, value)
+    await cache.aadd(key, 0, period)
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 1, period)
+        count = 1
+    return count <= capacity
+
+
+def allow_resend_activation(email, client_ip):
+    """
+    Return whether the activation email may be sent again to ``email`` at
+    the request of ``client_ip``, taking a token from the bucket of each.
+    The bucket of ``email`` is checked first, so a request refused for
+    ``email`` leaves the token of ``client_ip``.
+    """
+    email = email.lower()
+    return (
+        has_token("resend_email", email)
+        and take_token("resend_ip", client_ip)
+        and take_token("resend_email", email)
+    )
+
+
+async def aallow_resend_activation(email, client_ip):
+    """
+    Asynchronous version of ``allow_resend_activation``.
+    """
+    email = email.lower()
+    return (
+        await ahas_token("resend_email", email)
+        and await atake_token("resend_ip", client_ip)
+        and await atake_token("resend_email", email)
+    )
@@ -0,0 +1,212 @@
+"""
+An in-process dispatcher sending registration emails from a thread pool,
+used when the ``REGISTRATION_EMAIL_DELIVERY`` setting is ``"thread"``.
+
+It suits deployments without a separate worker process: the response is
+returned before the mail server answers. The number of queued emails is
+bounded by ``REGISTRATION_EMAIL_QUEUE_SIZE``; once it is reached, emails are
+sent inline, so a slow mail server slows requests down instead of growing
+the memory of the process. Queued emails are sent before the process exits,
+but are lost if it is killed; use the outbox when every email matters.
+
+Emails travel in lanes: activation emails, which a user is waiting for, in
+the ``"activation"`` lane, and the emails to and from the administrators in
+the ``"notification"`` lane. Each lane has its own dispatcher, with its own
+threads, queue and counters, so a backlog of notifications never delays an
+activation email.
+
+Emails are sent over the connection of the email settings, unless
+``use_email_connection`` selects another backend, e.g. to measure the
+pipeline against a local server.
+
+"""
+
+import atexit
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from .signals import email_sent
+
+logger = logging.getLogger(__name__)
+
+ACTIVATION_LANE = "activation"
+NOTIFICATION_LANE = "notification"
+# The lanes, by decreasing priority.
+LANES = (ACTIVATION_LANE, NOTIFICATION_LANE)
+
+
+def get_email_lane(email_message):
+    """
+    Return the lane of ``email_message``, the activation lane unless
+    ``build_email`` was told otherwise.
+    """
+    return getattr(email_message, "lane", ACTIVATION_LANE)
+
+
+def get_lane_setting(name, lane, default):
+    """
+    Return the value of setting ``name`` for ``lane``. The setting is
+    either a value for every lane or a dictionary of values by lane.
+    """
+    value = getattr(settings, name, default)
+    if isinstance(value, dict):
+        return value.get(lane, default)
+    return value
+
+
+_connection_options = None
+
+
+def get_email_connection():
+    """
+    Return a new connection to the mail server, with the backend and
+    options given to ``use_email_connection``, or the email settings.
+    """
+    if _connection_options is None:
+        return get_connection()
+    return get_connection(**_connection_options)
+
+
+@contextlib.contextmanager
+def use_email_connection(backend, **kwargs):
+    """
+    Send the registration emails of the process with ``backend`` and its
+    options ``kwargs``, such as ``host`` and ``port``, within the block,
+    in every thread.
+    """
+    global _connection_options
+    previous, _connection_options = _connection_options, {
+        "backend": backend,
+        **kwargs,
+    }
+    try:
+        yield
+    finally:
+        _connection_options = previous
+
+
+def send_messages(email_messages, connection=None):
+    """
+    Send ``email_messages`` over ``connection``, a new connection from
+    ``get_email_connection`` by default, and send the ``email_sent`` signal
+    for each of them, with the time spent and the exception raised, if any.
+    """
+    if connection is None:
+        connection = get_email_connection()
+    exception = None
+    start = time.perf_counter()
+    try:
+        connection.send_messages(email_messages)
+    except Exception as exc:
+        exception = exc
+        raise
+    finally:
+        if email_sent.has_listeners():
+            duration = (time.perf_counter() - start) / len(email_messages)
+            for email_message in email_messages:
+                email_sent.send(
+                    sender=connection.__class__,
+                    template_name=getattr(email_message, "template_name", None),
+                    lane=get_email_lane(email_message),
+                    duration=duration,
+                    size=len(email_message.message().as_bytes()),
+                    exception=exception,
+                )
+
+
+class EmailDispatcher:
+    """
+    Send lists of email messages of ``lane`` from a pool of ``max_workers``
+    threads.
+
+    ``queue_depth`` is the number of messages waiting or being sent,
+    ``sent_count`` and ``failed_count`` the number of messages sent and
+    which failed to be sent, ``rejected_count`` the number of messages
+    refused because the queue was full.
+    """
+
+    def __init__(self, max_workers, lane=ACTIVATION_LANE):
+        self.max_workers = max_workers
+        self.lane = lane
+        self.queue_depth = 0
+        self.sent_count = 0
+        self.failed_count = 0
+        self.rejected_count = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, email_messages):
+        """
+        Queue ``email_messages`` to be sent over a single connection. Return
+        ``False``, without queuing them, if the queue is full.
+        """
+        max_queue_size = get_lane_setting(
+            "REGISTRATION_EMAIL_QUEUE_SIZE", self.lane, 100
+        )
+        with self._lock:
+            if self.queue_depth + len(email_messages) > max_queue_size:
+                self.rejected_count += len(email_messages)
+                return False
+            self.queue_depth += len(email_messages)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"registration-email-{self.lane}",
+                )
+            self._executor.submit(self._send, email_messages)
+        return True
+
+    def _send(self, email_messages):
+        try:
+            send_messages(email_messages)
+        except Exception:
+            logger.exception(
+                "Failed to send %d registration emails of the %s lane.",
+                len(email_messages),
+                self.lane,
+            )
+            sent, failed = 0, len(email_messages)
+        else:
+            sent, failed = len(email_messages), 0
+        with self._lock:
+            self.queue_depth -= len(email_messages)
+            self.sent_count += sent
+            self.failed_count += failed
+
+    def drain(self):
+        """
+        Wait until the queued emails are sent. The threads are started again
+        by the next ``submit``.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_dispatchers = {}
+_dispatcher_lock = threading.Lock()
+
+
+def get_email_dispatcher(lane=ACTIVATION_LANE):
+    """
+    Return the dispatcher of ``lane`` in the process, running
+    ``REGISTRATION_EMAIL_THREADS`` threads (2 for the activation lane and 1
+    for the notification lane by default).
+    """
+    with _dispatcher_lock:
+        if lane not in _dispatchers:
+            default = 2 if lane == ACTIVATION_LANE else 1
+            dispatcher = EmailDispatcher(
+                get_lane_setting("REGISTRATION_EMAIL_THREADS", lane, default),
+                lane,
+            )
+            atexit.register(dispatcher.drain)
+            _dispatchers[lane] = dispatcher
+    return _dispatchers[lane]
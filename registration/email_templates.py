@@ -0,0 +1,75 @@
+"""
+A registry of the compiled templates of the registration emails.
+
+Each email is made of a subject, a text body and an optional HTML body
+template, whose names come from the settings. They are looked up and
+compiled once per process, and an HTML body template which does not exist
+is remembered as such, so sending many emails only costs the rendering of
+their context. The registry is cleared when a setting changes and, under
+the development server, when a template file changes.
+
+"""
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils.autoreload import file_changed
+
+EmailTemplates = namedtuple("EmailTemplates", ["subject", "body", "html"])
+
+_email_templates = {}
+
+
+def get_email_templates(subject_template, body_template, body_html_template):
+    """
+    Return the compiled ``EmailTemplates`` for the given template names.
+    ``html`` is ``None`` when ``body_html_template`` does not exist.
+    """
+    key = (subject_template, body_template, body_html_template)
+    try:
+        return _email_templates[key]
+    except KeyError:
+        pass
+
+    try:
+        html = get_template(body_html_template)
+    except TemplateDoesNotExist:
+        html = None
+    templates = EmailTemplates(
+        get_template(subject_template), get_template(body_template), html
+    )
+    _email_templates[key] = templates
+    return templates
+
+
+def render_email(
+    subject_template, body_template, body_html_template, context, request=None
+):
+    """
+    Render the templates of an email with ``context``, and return its
+    subject, text body and HTML body. The HTML body is ``None`` if its
+    template does not exist or ``REGISTRATION_EMAIL_HTML`` is ``False``.
+    """
+    templates = get_email_templates(subject_template, body_template, body_html_template)
+    subject = templates.subject.render(context, request)
+    body = templates.body.render(context, request)
+    html = None
+    if templates.html is not None and getattr(
+        settings, "REGISTRATION_EMAIL_HTML", True
+    ):
+        html = templates.html.render(context, request)
+    return subject, body, html
+
+
+@receiver(setting_changed)
+@receiver(file_changed)
+def clear_email_templates(**kwargs):
+    """
+    Forget the compiled templates, which may no longer be the ones the
+    settings or the template files designate.
+    """
+    _email_templates.clear()
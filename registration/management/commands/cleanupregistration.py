@@ -2,27 +2,279 @@
 A management command which deletes expired accounts (e.g.,
 accounts which signed up but never activated) from the database.
 
-Calls ``RegistrationProfile.objects.delete_expired_users()``, which
+Calls ``RegistrationProfile.objects.delete_expired_batches()``, which
 contains the actual logic for determining which accounts are deleted.
 
+Accounts are deleted ``--batch-size`` at a time, one transaction per batch,
+with ``--sleep`` seconds between batches to let replicas catch up. Once
+``--max-runtime`` seconds have passed, the command stops after the current
+batch; the next run resumes where it stopped. ``--dry-run`` only counts the
+accounts which would be deleted.
+
+``--archive PATH`` appends the deleted profiles and users to an archive
+before deleting them, see ``registration.archive``.
+
+``--database`` selects the database alias to clean up. ``--workers N``
+splits the ids of the expired profiles into N ranges, deleted concurrently
+by a pool of N processes, each with its own database connection. SQLite
+only accepts one writer at a time, so its ranges are deleted one after the
+other.
+
+``--json`` replaces the progress messages with a JSON summary of the run,
+for monitoring: the number of users deleted and of batches, whether
+``--max-runtime`` stopped the run and how long it took.
+
 """
 
+import contextlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.apps import apps
 from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from django.db.models import Max
+from django.db.models import Min
 
+from ...archive import RegistrationArchive
+from ...archive import get_archive_fields
 from ...models import RegistrationProfile
 
 
+def run_batches(batches, deadline=None, sleep=0, progress=None):
+    """
+    Run the ``batches`` generator of ``delete_expired_batches``, calling
+    ``progress`` with the count of each batch and the total, until it is
+    exhausted or the ``time.time()`` passes ``deadline``. Return the number
+    of profiles deleted and of batches, and whether the deadline stopped the
+    deletion.
+    """
+    summary = {"deleted_count": 0, "batch_count": 0, "stopped": False}
+    for batch_count in batches:
+        summary["deleted_count"] += batch_count
+        summary["batch_count"] += 1
+        if progress is not None:
+            progress(batch_count, summary["deleted_count"])
+        if deadline is not None and time.time() >= deadline:
+            batches.close()
+            summary["stopped"] = True
+            break
+        if sleep:
+            time.sleep(sleep)
+    return summary
+
+
+def init_worker():
+    """
+    Set up Django in a worker process started without ``fork``.
+    """
+    if not apps.ready:
+        django.setup()
+
+
+def delete_range(database, batch_size, min_pk, max_pk, deadline, sleep):
+    """
+    Delete the expired profiles whose ids are between ``min_pk`` and
+    ``max_pk`` from ``database``, in a worker process. Return the summary
+    of ``run_batches``.
+    """
+    try:
+        manager = RegistrationProfile.objects.db_manager(database)
+        batches = manager.delete_expired_batches(
+            batch_size, min_pk=min_pk, max_pk=max_pk
+        )
+        return run_batches(batches, deadline, sleep)
+    finally:
+        connections.close_all()
+
+
+def split_range(min_pk, max_pk, count):
+    """
+    Split the ids from ``min_pk`` to ``max_pk`` into at most ``count``
+    ranges of the same width, returned as ``(min_pk, max_pk)``.
+    """
+    width = (max_pk - min_pk) // count + 1
+    return [
+        (start, min(start + width - 1, max_pk))
+        for start in range(min_pk, max_pk + 1, width)
+    ]
+
+
 class Command(BaseCommand):
     help = "Delete expired user registrations from the database"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Number of users deleted per transaction (default: the "
+            "REGISTRATION_CLEANUP_BATCH_SIZE setting, or 1000).",
+        )
+        parser.add_argument(
+            "--max-runtime",
+            type=float,
+            help="Stop after the running batch once this many seconds passed.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to wait between batches (default: 0).",
+        )
+        parser.add_argument(
+            "--archive",
+            metavar="PATH",
+            help="Append the deleted registrations to this JSON Lines file, "
+            "or CSV file if it ends with .csv, gzip compressed if it ends "
+            "with .gz.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help='The database to clean up (default: "default").',
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes deleting ranges of ids concurrently "
+            "(default: 1).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Count the users which would be deleted without deleting them.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Write a JSON summary of the run instead of progress messages.",
+        )
+
+    def write(self, message):
+        if not self.json:
+            self.stdout.write(message)
+
     def handle(self, *args, **options):
-        self.stdout.write("Running cleanupregistration.")
-        deleted_count = RegistrationProfile.objects.delete_expired_users()
-        if deleted_count == 0:
-            self.stdout.write(
+        if options["workers"] > 1 and options["archive"]:
+            raise CommandError("--archive cannot be used with --workers.")
+
+        self.json = options["json"]
+        self.write("Running cleanupregistration.")
+        start = time.monotonic()
+        manager = RegistrationProfile.objects.db_manager(options["database"])
+        if options["dry_run"]:
+            expired_count = manager.count_deletable()
+            self.write(
+                f"cleanupregistration completed. Expired user count={expired_count}"
+            )
+            summary = {"dry_run": True, "expired_count": expired_count}
+        else:
+            summary = self.delete_expired(manager, options)
+        if self.json:
+            summary["database"] = options["database"]
+            summary["elapsed"] = round(time.monotonic() - start, 3)
+            return json.dumps(summary)
+
+    def delete_expired(self, manager, options):
+        deadline = None
+        if options["max_runtime"] is not None:
+            deadline = time.time() + options["max_runtime"]
+        manager.backfill_expires_at(options["batch_size"])
+        if options["workers"] > 1:
+            summary = self.delete_parallel(manager, deadline, options)
+        else:
+            with contextlib.ExitStack() as stack:
+                archive = None
+                if options["archive"]:
+                    archive = stack.enter_context(
+                        RegistrationArchive(options["archive"], get_archive_fields())
+                    )
+                summary = self.delete(manager, archive, deadline, options)
+
+        deleted_count = summary["deleted_count"]
+        if summary["stopped"]:
+            self.write(
+                "cleanupregistration stopped at --max-runtime. "
+                f"Deleted user count={deleted_count}; run it again to resume."
+            )
+        elif deleted_count == 0:
+            self.write(
                 "cleanupregistration completed. There is no user has to be deleted."
             )
         else:
-            self.stdout.write(
+            self.write(
                 f"cleanupregistration completed. Deleted user count={deleted_count}"
             )
+        return summary
+
+    def delete(self, manager, archive, deadline, options):
+        start = time.monotonic()
+
+        def archive_batch(batch):
+            profiles = manager.filter(
+                pk__in=[profile_id for profile_id, _ in batch]
+            ).order_by("pk")
+            archive.write(
+                profiles.values(*archive.fields).iterator(chunk_size=len(batch))
+            )
+
+        def progress(batch_count, deleted_count):
+            self.write(
+                f"Deleted batch user count={batch_count}, "
+                f"total={deleted_count}, "
+                f"elapsed={time.monotonic() - start:.1f}s"
+            )
+
+        batches = manager.delete_expired_batches(
+            options["batch_size"], archive_batch if archive is not None else None
+        )
+        return run_batches(batches, deadline, options["sleep"], progress)
+
+    def delete_parallel(self, manager, deadline, options):
+        summary = {"deleted_count": 0, "batch_count": 0, "stopped": False}
+        bounds = manager.deletable().aggregate(min_pk=Min("pk"), max_pk=Max("pk"))
+        if bounds["min_pk"] is None:
+            return summary
+        ranges = split_range(bounds["min_pk"], bounds["max_pk"], options["workers"])
+        if connections[options["database"]].vendor == "sqlite":
+            self.stderr.write(
+                "SQLite accepts a single writer, the ranges are deleted one "
+                "after the other."
+            )
+            executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            # The workers open their own connections.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=len(ranges), initializer=init_worker
+            )
+
+        with executor:
+            futures = [
+                executor.submit(
+                    delete_range,
+                    options["database"],
+                    options["batch_size"],
+                    min_pk,
+                    max_pk,
+                    deadline,
+                    options["sleep"],
+                )
+                for min_pk, max_pk in ranges
+            ]
+            for (min_pk, max_pk), future in zip(ranges, futures):
+                range_summary = future.result()
+                self.write(
+                    f"Deleted range ids={min_pk}-{max_pk} "
+                    f"user count={range_summary['deleted_count']}"
+                )
+                summary["deleted_count"] += range_summary["deleted_count"]
+                summary["batch_count"] += range_summary["batch_count"]
+                summary["stopped"] |= range_summary["stopped"]
+        return summary
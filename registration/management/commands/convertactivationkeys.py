@@ -0,0 +1,66 @@
+"""
+A management command which rewrites the stored activation keys in the
+storage selected by ``--to`` (see the ``REGISTRATION_ACTIVATION_KEY_STORAGE``
+setting).
+
+Activation links keep working during the conversion: keys are looked up in
+both forms. Run it after changing the setting so existing profiles benefit
+from the smaller index as well.
+
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import RegistrationProfile
+from ...models import decode_activation_key
+from ...models import encode_activation_key
+
+
+class Command(BaseCommand):
+    help = "Convert stored registration activation keys to hex or base64"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--to",
+            choices=("hex", "base64"),
+            required=True,
+            help="The storage to convert the activation keys to.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of profiles updated per transaction (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        profiles = RegistrationProfile.objects.only("pk", "activation_key").order_by(
+            "pk"
+        )
+        converted_count = 0
+        last_pk = None
+        while True:
+            batch = profiles if last_pk is None else profiles.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            changed = []
+            for profile in batch:
+                activation_key = encode_activation_key(
+                    decode_activation_key(profile.activation_key), options["to"]
+                )
+                if activation_key != profile.activation_key:
+                    profile.activation_key = activation_key
+                    changed.append(profile)
+            if changed:
+                with transaction.atomic():
+                    RegistrationProfile.objects.bulk_update(changed, ["activation_key"])
+                converted_count += len(changed)
+
+        self.stdout.write(
+            f"convertactivationkeys completed. Converted profile count={converted_count}"
+        )
@@ -0,0 +1,213 @@
+"""
+A management command which measures the throughput of the registration
+email pipeline against a local SMTP sink (see ``registration.smtp_sink``).
+
+It registers ``--count`` users at ``--rate`` registrations per second,
+sending their activation emails with the ``REGISTRATION_EMAIL_DELIVERY``
+in use, and, with ``--flow admin_approval``, activates and approves them so
+the administrators are emailed too. The outbox, if used, is then drained
+like ``registration_mailworker`` would, retrying failed emails at once.
+
+It writes to the configured database: run it against a scratch database.
+The users it registers, and the emails it queued, are deleted at the end.
+The activation links point to the current ``Site``, or to ``--domain``, as
+with ``sendapprovaldigest``.
+
+"""
+
+import smtplib
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from ...dispatch import LANES
+from ...dispatch import get_email_dispatcher
+from ...dispatch import use_email_connection
+from ...models import OutboxEmail
+from ...models import RegistrationProfile
+from ...models import SupervisedRegistrationProfile
+from ...models import get_email_delivery
+from ...signals import email_sent
+from ...smtp_sink import SMTPSink
+from .sendapprovaldigest import get_site
+
+from .registration_mailworker import Command as MailWorkerCommand
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank ``percent`` percentile of ``values``, or 0 if
+    there are none.
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, round(percent / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Measure the registration email throughput against a local SMTP sink"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=100,
+            help="Number of users registered (default: 100).",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Registrations per second, 0 for as fast as possible (default: 0).",
+        )
+        parser.add_argument(
+            "--flow",
+            choices=("default", "admin_approval"),
+            default="default",
+            help="The registration workflow to drive (default: default).",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="Seconds the SMTP sink waits before answering each email "
+            "(default: 0).",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0,
+            help="Probability that the SMTP sink refuses an email (default: 0).",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Number of attempts before an outbox email is given up "
+            "(default: 5).",
+        )
+        parser.add_argument(
+            "--domain",
+            help="The domain of the activation links, when django.contrib.sites "
+            "is not installed.",
+        )
+
+    def handle(self, *args, **options):
+        site = get_site(options["domain"])
+        send_durations = []
+        send_failures = Counter()
+
+        def record_email(sender, duration, exception, **kwargs):
+            send_durations.append(duration)
+            if exception is not None:
+                send_failures[type(exception).__name__] += 1
+
+        sink = SMTPSink(
+            latency=options["latency"], failure_rate=options["failure_rate"]
+        )
+        with sink, use_email_connection(
+            "django.core.mail.backends.smtp.EmailBackend",
+            host=sink.host,
+            port=sink.port,
+            username="",
+            password="",
+            use_tls=False,
+            use_ssl=False,
+        ):
+            email_sent.connect(record_email)
+            prefix = f"loadtest-{uuid.uuid4().hex[:8]}-"
+            last_outbox_pk = OutboxEmail.objects.aggregate(pk=Max("pk"))["pk"] or 0
+            start = time.monotonic()
+            try:
+                latencies, errors = self.register(prefix, site, options)
+                outbox = self.drain(last_outbox_pk, options["max_attempts"])
+                elapsed = time.monotonic() - start
+            finally:
+                email_sent.disconnect(record_email)
+                get_user_model().objects.filter(username__startswith=prefix).delete()
+                OutboxEmail.objects.filter(pk__gt=last_outbox_pk).delete()
+
+        self.stdout.write(
+            f"Registrations: count={options['count']}, failed={sum(errors.values())}, "
+            f"rate={options['count'] / elapsed:.1f}/s, "
+            f"p50={percentile(latencies, 50) * 1000:.1f}ms, "
+            f"p99={percentile(latencies, 99) * 1000:.1f}ms"
+        )
+        self.stdout.write(
+            f"Emails: sent={sink.message_count}, refused={sink.failure_count}, "
+            f"rate={sink.message_count / elapsed:.1f}/s, "
+            f"p50={percentile(send_durations, 50) * 1000:.1f}ms, "
+            f"p99={percentile(send_durations, 99) * 1000:.1f}ms"
+        )
+        if outbox is not None:
+            self.stdout.write(
+                f"Outbox: retried={outbox['retried']}, "
+                f"given up={outbox['given_up']}, attempts={outbox['attempts']}"
+            )
+        for name, count in sorted(errors.items()):
+            self.stdout.write(f"Registration failures: {name}={count}")
+        for name, count in sorted(send_failures.items()):
+            self.stdout.write(f"Email failures: {name}={count}")
+
+    def register(self, prefix, site, options):
+        """
+        Register the users of ``site`` at the requested rate, and return the
+        latency of each registration and the count of exceptions raised by
+        class.
+        """
+        if options["flow"] == "admin_approval":
+            manager = SupervisedRegistrationProfile.objects
+        else:
+            manager = RegistrationProfile.objects
+        latencies = []
+        errors = Counter()
+        start = time.monotonic()
+        for i in range(options["count"]):
+            if options["rate"]:
+                delay = start + i / options["rate"] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            registered_at = time.monotonic()
+            try:
+                user = manager.create_inactive_user(
+                    site=site,
+                    username=f"{prefix}{i}",
+                    password="loadtest",
+                    email=f"{prefix}{i}@example.com",
+                )
+                if options["flow"] == "admin_approval":
+                    profile = manager.get(user=user)
+                    manager.activate_user(profile.get_activation_key(), site)
+                    manager.admin_approve_user(profile.pk, site)
+            except (smtplib.SMTPException, OSError) as exc:
+                # The emails sent inline fail with the registration.
+                errors[type(exc).__name__] += 1
+            latencies.append(time.monotonic() - registered_at)
+        return latencies, errors
+
+    def drain(self, last_outbox_pk, max_attempts):
+        """
+        Wait for the emails queued in the thread dispatcher or the outbox to
+        be sent. Return the retry statistics of the outbox, if used.
+        """
+        match get_email_delivery():
+            case "thread":
+                for lane in LANES:
+                    get_email_dispatcher(lane).drain()
+            case "outbox":
+                worker = MailWorkerCommand()
+                while any(worker.send_batch(100, max_attempts, 0)):
+                    pass
+                emails = OutboxEmail.objects.filter(pk__gt=last_outbox_pk)
+                return {
+                    "retried": emails.filter(attempts__gt=1).count(),
+                    "given_up": emails.filter(sent_at=None).count(),
+                    "attempts": sum(emails.values_list("attempts", flat=True)),
+                }
+        return None
@@ -0,0 +1,162 @@
+"""
+A management command which sends the registration emails queued in the
+outbox (see the ``REGISTRATION_EMAIL_DELIVERY`` setting).
+
+Emails are claimed in batches with ``SELECT ... FOR UPDATE SKIP LOCKED``
+where the database supports it, so several workers can drain the outbox
+at once. A claim is a lease: the claiming transaction postpones the next
+attempt of the emails by ``--lease`` seconds and commits, the emails are
+then sent outside of any transaction, and their results recorded. The
+emails of a worker which died while sending are retried once the lease
+expires. Failed emails are retried with an exponential backoff until
+``--max-attempts`` is reached.
+
+Activation emails are sent before the notifications to and from the
+administrators. Run workers with ``--lane`` to give each lane its own
+concurrency.
+
+"""
+
+import datetime
+import logging
+import smtplib
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ...dispatch import LANES
+from ...dispatch import get_email_connection
+from ...dispatch import send_messages
+from ...models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Send the registration emails queued in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of emails sent per transaction (default: 100).",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Number of attempts before an email is given up (default: 5).",
+        )
+        parser.add_argument(
+            "--backoff",
+            type=float,
+            default=60,
+            help="Seconds before the first retry, doubled after each "
+            "failure (default: 60).",
+        )
+        parser.add_argument(
+            "--lease",
+            type=float,
+            default=300,
+            help="Seconds a batch is claimed for while it is sent; its emails "
+            "are sent again if the worker dies meanwhile (default: 300).",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait when the outbox is empty (default: 5).",
+        )
+        parser.add_argument(
+            "--lane",
+            choices=LANES,
+            help="Only send the emails of this lane (default: every lane, "
+            "activation emails first).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the outbox is drained instead of polling it.",
+        )
+
+    def handle(self, *args, **options):
+        sent_count = failed_count = 0
+        while True:
+            sent, failed = self.send_batch(
+                options["batch_size"],
+                options["max_attempts"],
+                options["backoff"],
+                options["lane"],
+                options["lease"],
+            )
+            sent_count += sent
+            failed_count += failed
+            if sent or failed:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
+
+        self.stdout.write(
+            f"registration_mailworker completed. Sent email count={sent_count}, "
+            f"failed email count={failed_count}"
+        )
+
+    def send_batch(self, batch_size, max_attempts, backoff, lane=None, lease=300):
+        """
+        Send the next ``batch_size`` due emails, of ``lane`` if given, over
+        one connection and return the number of emails sent and failed.
+        """
+        emails = self.claim_batch(batch_size, max_attempts, lane, lease)
+        sent = failed = 0
+        if not emails:
+            return sent, failed
+
+        connection = get_email_connection()
+        try:
+            connection.open()
+        except (smtplib.SMTPException, OSError):
+            # Each email retries the connection, and records the error.
+            logger.exception("Failed to open the registration email connection.")
+        try:
+            for email in emails:
+                try:
+                    send_messages([email.get_message()], connection)
+                except Exception as exc:
+                    email.last_error = repr(exc)
+                    email.next_attempt_at = timezone.now() + datetime.timedelta(
+                        seconds=backoff * 2 ** (email.attempts - 1)
+                    )
+                    failed += 1
+                else:
+                    email.sent_at = timezone.now()
+                    sent += 1
+        finally:
+            connection.close()
+
+        OutboxEmail.objects.bulk_update(
+            emails, ["last_error", "next_attempt_at", "sent_at"]
+        )
+        return sent, failed
+
+    def claim_batch(self, batch_size, max_attempts, lane=None, lease=300):
+        """
+        Claim the next ``batch_size`` due emails, of ``lane`` if given, for
+        ``lease`` seconds and return them. The claim is committed before
+        the emails are sent.
+        """
+        with transaction.atomic():
+            emails = list(
+                OutboxEmail.objects.due(max_attempts, lane=lane).select_for_update(
+                    skip_locked=True
+                )[:batch_size]
+            )
+            leased_until = timezone.now() + datetime.timedelta(seconds=lease)
+            for email in emails:
+                email.attempts += 1
+                email.next_attempt_at = leased_until
+            OutboxEmail.objects.bulk_update(emails, ["attempts", "next_attempt_at"])
+        return emails
@@ -0,0 +1,73 @@
+"""
+A management command which finds ``RegistrationProfile`` rows sharing the
+same activation key and gives all but one of them a fresh key.
+
+Activation keys are unique since migration ``0007_activation_key_unique``;
+run this command before applying that migration on a database which may
+contain duplicates (e.g. the ``ALREADY_ACTIVATED`` placeholder written by
+older releases), otherwise the index build fails.
+
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Min
+
+from ...models import RegistrationProfile
+
+
+class Command(BaseCommand):
+    help = "Detect and repair duplicate registration activation keys"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of profiles updated per transaction (default: 1000).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report duplicate activation keys, do not repair them.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        duplicates = (
+            RegistrationProfile.objects.values("activation_key")
+            .annotate(count=Count("pk"), keep=Min("pk"))
+            .filter(count__gt=1)
+            .order_by()
+        )
+        repaired_count = 0
+        for duplicate in list(duplicates):
+            self.stdout.write(
+                f"Activation key {duplicate['activation_key']!r} is shared by "
+                f"{duplicate['count']} profiles."
+            )
+            if options["dry_run"]:
+                continue
+
+            profiles = (
+                RegistrationProfile.objects.filter(
+                    activation_key=duplicate["activation_key"]
+                )
+                .exclude(pk=duplicate["keep"])
+                .only("pk", "activation_key")
+                .order_by("pk")
+            )
+            while batch := list(profiles[:batch_size]):
+                for profile in batch:
+                    profile.create_new_activation_key(save=False)
+                with transaction.atomic():
+                    RegistrationProfile.objects.bulk_update(batch, ["activation_key"])
+                repaired_count += len(batch)
+
+        if options["dry_run"]:
+            self.stdout.write("repairactivationkeys completed (dry run).")
+        else:
+            self.stdout.write(
+                f"repairactivationkeys completed. Repaired profile count={repaired_count}"
+            )
@@ -0,0 +1,66 @@
+"""
+A management command which sends each site administrator one email listing
+the accounts awaiting their approval.
+
+Use it with the ``REGISTRATION_ADMIN_APPROVAL_DIGEST`` setting, which stops
+the admin_approval backend from emailing the administrators on every
+activation. Run it periodically from cron, or let it repeat itself with
+``--interval``.
+
+The approval links point to the current ``Site``. Without
+``django.contrib.sites``, pass the domain they point to with ``--domain``.
+
+"""
+
+import time
+
+from django.apps import apps
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.http import HttpRequest
+
+from ...models import SupervisedRegistrationProfile
+
+
+def get_site(domain=None):
+    """
+    Return the site of the approval links: the current ``Site``, or a
+    ``RequestSite`` of ``domain`` without ``django.contrib.sites``.
+    """
+    request = None
+    if domain is not None:
+        request = HttpRequest()
+        request.META["HTTP_HOST"] = domain
+    elif not apps.is_installed("django.contrib.sites"):
+        raise CommandError("--domain is required without django.contrib.sites.")
+    return get_current_site(request)
+
+
+class Command(BaseCommand):
+    help = "Email the site administrators the accounts awaiting approval"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Send a digest every INTERVAL seconds instead of once.",
+        )
+        parser.add_argument(
+            "--domain",
+            help="The domain of the approval links, when django.contrib.sites "
+            "is not installed.",
+        )
+
+    def handle(self, *args, **options):
+        site = get_site(options["domain"])
+        while True:
+            profile_count = (
+                SupervisedRegistrationProfile.objects.send_admin_approve_digest(site)
+            )
+            self.stdout.write(
+                f"sendapprovaldigest completed. Awaiting approval count={profile_count}"
+            )
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,113 @@
+from django.db import migrations
+from django.db import models
+
+# Building the index on a large, live profile table must not block writes.
+# PostgreSQL can do that with ``CREATE INDEX CONCURRENTLY``, which cannot run
+# inside a transaction, hence ``atomic = False``; the index then backs the
+# unique constraint Django expects, with ``ADD CONSTRAINT ... USING INDEX``.
+# Rerunning the migration after a failed build drops the invalid index left
+# behind first. Other backends only need a plain ``CREATE UNIQUE INDEX``:
+# unlike ``AlterField``, it does not rebuild the whole table on SQLite.
+#
+# Existing duplicate keys (e.g. the ``ALREADY_ACTIVATED`` placeholder left by
+# migration 0003) make the index build fail; run
+# ``manage.py repairactivationkeys`` before applying this migration.
+
+
+def _index_name(apps, schema_editor):
+    RegistrationProfile = apps.get_model("registration", "RegistrationProfile")
+    table = RegistrationProfile._meta.db_table
+    column = RegistrationProfile._meta.get_field("activation_key").column
+    # The name Django gives the constraint of ``unique=True``.
+    name = schema_editor._create_index_name(table, [column], suffix="_uniq")
+    return table, column, name
+
+
+def _postgresql_index_state(schema_editor, name):
+    """
+    Return ``None`` if there is no index ``name``, else whether it is valid
+    and whether it backs a constraint.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT pg_index.indisvalid, pg_constraint.oid IS NOT NULL
+            FROM pg_class
+            JOIN pg_index ON pg_index.indexrelid = pg_class.oid
+            LEFT JOIN pg_constraint ON pg_constraint.conindid = pg_class.oid
+            WHERE pg_class.relname = %s AND pg_class.relkind = 'i'
+            """,
+            [name],
+        )
+        return cursor.fetchone()
+
+
+def create_activation_key_index(apps, schema_editor):
+    table, column, name = _index_name(apps, schema_editor)
+    quote_name = schema_editor.quote_name
+    if schema_editor.connection.vendor != "postgresql":
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX {quote_name(name)} ON {quote_name(table)} "
+            f"({quote_name(column)})"
+        )
+        return
+
+    state = _postgresql_index_state(schema_editor, name)
+    if state is not None and not state[0]:
+        # An interrupted or failed concurrent build, e.g. on duplicate keys,
+        # leaves an invalid index behind.
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY {quote_name(name)}")
+        state = None
+    if state is None:
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY {quote_name(name)} "
+            f"ON {quote_name(table)} ({quote_name(column)})"
+        )
+    if state is None or not state[1]:
+        # Django removes ``unique=True`` with ``DROP CONSTRAINT``: the index
+        # becomes the constraint the migration state records.
+        schema_editor.execute(
+            f"ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(name)} "
+            f"UNIQUE USING INDEX {quote_name(name)}"
+        )
+
+
+def drop_activation_key_index(apps, schema_editor):
+    table, _, name = _index_name(apps, schema_editor)
+    quote_name = schema_editor.quote_name
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"ALTER TABLE {quote_name(table)} DROP CONSTRAINT {quote_name(name)}"
+        )
+    else:
+        schema_editor.execute(
+            schema_editor.sql_delete_index
+            % {"name": quote_name(name), "table": quote_name(table)}
+        )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("registration", "0006_alter_registrationprofile_id"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    create_activation_key_index, drop_activation_key_index
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="registrationprofile",
+                    name="activation_key",
+                    field=models.CharField(
+                        max_length=64, unique=True, verbose_name="activation key"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0007_activation_key_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="registrationprofile",
+            name="expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                null=True,
+                verbose_name="activation key expiration date",
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+import datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.db import transaction
+
+# Number of profiles updated per transaction, so that the backfill of a
+# large table never holds long locks.
+BATCH_SIZE = 1000
+
+
+def backfill_expires_at(apps, schema_editor):
+    RegistrationProfile = apps.get_model("registration", "RegistrationProfile")
+    db_alias = schema_editor.connection.alias
+    activation_window = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+    profiles = (
+        RegistrationProfile.objects.using(db_alias)
+        .filter(expires_at=None)
+        .select_related("user")
+        .only("pk", "expires_at", "user__date_joined")
+        .order_by("pk")
+    )
+    while batch := list(profiles[:BATCH_SIZE]):
+        for profile in batch:
+            profile.expires_at = profile.user.date_joined + activation_window
+        with transaction.atomic(using=db_alias):
+            RegistrationProfile.objects.using(db_alias).bulk_update(
+                batch, ["expires_at"]
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("registration", "0008_registrationprofile_expires_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0010_outboxemail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="registrationprofile",
+            name="last_sent_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="activation email last sent at"
+            ),
+        ),
+    ]
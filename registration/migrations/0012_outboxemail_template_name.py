@@ -0,0 +1,18 @@
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0011_registrationprofile_last_sent_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxemail",
+            name="template_name",
+            field=models.CharField(
+                blank=True, max_length=255, verbose_name="template name"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0012_outboxemail_template_name"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="outboxemail",
+            name="registratio_sent_at_b70611_idx",
+        ),
+        migrations.AddField(
+            model_name="outboxemail",
+            name="priority",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Emails of a lower priority are sent first.",
+                verbose_name="priority",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="outboxemail",
+            index=models.Index(
+                fields=["sent_at", "priority", "next_attempt_at"],
+                name="registratio_sent_at_176c62_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0013_outboxemail_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="supervisedregistrationprofile",
+            name="approved_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="approved at"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill_approved_at(apps, schema_editor):
+    # The approval date of the accounts approved so far is unknown: they are
+    # marked as approved when migrating.
+    SupervisedRegistrationProfile = apps.get_model(
+        "registration", "SupervisedRegistrationProfile"
+    )
+    db_alias = schema_editor.connection.alias
+    SupervisedRegistrationProfile.objects.using(db_alias).filter(
+        activated=True, user__is_active=True, approved_at=None
+    ).update(approved_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0014_supervisedregistrationprofile_approved_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_approved_at, migrations.RunPython.noop),
+    ]
@@ -1,34 +1,89 @@
 import datetime
 import hashlib
 import logging
+import math
+import random
 import re
 import string
+import time
 import warnings
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core import signing
 from django.core.exceptions import ImproperlyConfigured
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import EmailMultiAlternatives
 from django.db import models
+from django.db import router
 from django.db import transaction
-from django.template import TemplateDoesNotExist
-from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.utils.crypto import get_random_string
+from django.utils.http import urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_encode
 from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
 
+from asgiref.sync import sync_to_async
+
+from . import signals
+from .cache import ais_unknown_activation_key
+from .cache import aremember_unknown_activation_key
+from .cache import is_unknown_activation_key
+from .cache import remember_unknown_activation_key
+from .dispatch import ACTIVATION_LANE
+from .dispatch import LANES
+from .dispatch import NOTIFICATION_LANE
+from .dispatch import get_email_dispatcher
+from .dispatch import get_email_lane
+from .dispatch import send_messages
+from .email_templates import render_email
+
 logger = logging.getLogger(__name__)
 
 # Adding some backwards compatibility for SHA1
 SHA256_RE = re.compile("^[a-f0-9]{64}$")
 
+# Salt of the signed activation keys, see ``REGISTRATION_SIGNED_ACTIVATION_KEYS``.
+ACTIVATION_KEY_SALT = "registration.activation"
+# Number of characters of the activation key embedded in a signed key.
+ACTIVATION_KEY_FINGERPRINT_LENGTH = 16
+
+# A SHA256 hash encoded in unpadded base64url, see
+# ``REGISTRATION_ACTIVATION_KEY_STORAGE``.
+BASE64_SHA256_RE = re.compile("^[A-Za-z0-9_-]{43}$")
+
 User = get_user_model()
 
 
+def encode_activation_key(activation_key, storage=None):
+    """
+    Return the form in which the hexadecimal ``activation_key`` is stored.
+
+    ``storage`` defaults to the ``REGISTRATION_ACTIVATION_KEY_STORAGE``
+    setting: ``"hex"`` stores the key as is, ``"base64"`` stores the 32 raw
+    bytes of the hash as 43 base64url characters.
+    """
+    if storage is None:
+        storage = getattr(settings, "REGISTRATION_ACTIVATION_KEY_STORAGE", "hex")
+    if storage == "base64" and SHA256_RE.search(activation_key):
+        return urlsafe_base64_encode(bytes.fromhex(activation_key))
+    return activation_key
+
+
+def decode_activation_key(activation_key):
+    """
+    Return the hexadecimal form of a stored ``activation_key``, whichever
+    storage it was written with.
+    """
+    if BASE64_SHA256_RE.search(activation_key):
+        return urlsafe_base64_decode(activation_key).hex()
+    return activation_key
+
+
 def get_from_email(site=None):
     """
     Return the email address by which mail is sent.
@@ -56,34 +111,160 @@ def get_from_email(site=None):
     return from_email
 
 
+def get_registration_admins():
+    """
+    Return the email addresses of the site administrators approving the
+    registrations: ``REGISTRATION_ADMINS``, which may be the dotted path of
+    a function returning them, or ``ADMINS``.
+    """
+    registration_admins = getattr(settings, "REGISTRATION_ADMINS", None)
+    if isinstance(registration_admins, str):  # We have a getter
+        admins_getter = import_string(registration_admins)
+        admins = admins_getter()
+    else:
+        admins = registration_admins or getattr(settings, "ADMINS", None)
+    if not registration_admins:
+        warnings.warn(
+            "No registration admin defined in"
+            " settings.REGISTRATION_ADMINS."
+            " Using settings.ADMINS for the admin approval",
+            UserWarning,
+        )
+    if not admins:
+        raise ImproperlyConfigured(
+            "Using the admin_approval registration backend"
+            " requires at least one admin in settings.ADMINS"
+            " or settings.REGISTRATION_ADMINS"
+        )
+
+    return [admin[1] for admin in admins]
+
+
+def get_admin_approval_digest():
+    """
+    Return whether the site administrators are notified of the accounts to
+    approve in a periodic digest, according to the
+    ``REGISTRATION_ADMIN_APPROVAL_DIGEST`` setting, rather than one email
+    per account.
+    """
+    return getattr(settings, "REGISTRATION_ADMIN_APPROVAL_DIGEST", False)
+
+
+def get_email_delivery():
+    """
+    Return how registration emails are delivered, according to the
+    ``REGISTRATION_EMAIL_DELIVERY`` setting: ``"inline"`` sends them right
+    away, ``"thread"`` hands them to the in-process ``EmailDispatcher``,
+    ``"outbox"`` writes them to ``OutboxEmail`` for the
+    ``registration_mailworker`` command to send.
+    """
+    return getattr(settings, "REGISTRATION_EMAIL_DELIVERY", "inline")
+
+
+def deliver_email(email_message):
+    """
+    Send ``email_message``, or queue it in the outbox, depending on
+    ``get_email_delivery()``.
+    """
+    delivery = get_email_delivery()
+    if delivery == "outbox":
+        OutboxEmail.objects.enqueue(email_message)
+        return
+    lane = get_email_lane(email_message)
+    if delivery == "thread" and get_email_dispatcher(lane).submit([email_message]):
+        return
+    send_messages([email_message])
+
+
+def deliver_emails(email_messages):
+    """
+    Send ``email_messages``, or queue them in the outbox, depending on
+    ``get_email_delivery()``.
+
+    Messages are sent lane by lane, in batches of
+    ``REGISTRATION_EMAIL_BATCH_SIZE`` (100 by default), each batch over a
+    single connection to the mail server.
+    """
+    delivery = get_email_delivery()
+    if delivery == "outbox":
+        OutboxEmail.objects.enqueue_many(email_messages)
+        return
+    batch_size = getattr(settings, "REGISTRATION_EMAIL_BATCH_SIZE", 100)
+    for lane in LANES:
+        lane_messages = [
+            email_message
+            for email_message in email_messages
+            if get_email_lane(email_message) == lane
+        ]
+        for start in range(0, len(lane_messages), batch_size):
+            batch = lane_messages[start : start + batch_size]
+            if delivery == "thread" and get_email_dispatcher(lane).submit(batch):
+                continue
+            send_messages(batch)
+
+
 def send_email(
-    addresses_to, ctx_dict, subject_template, body_template, body_html_template
+    addresses_to,
+    ctx_dict,
+    subject_template,
+    body_template,
+    body_html_template,
+    lane=ACTIVATION_LANE,
 ):
     """
     Function that sends an email
     """
+    deliver_email(
+        build_email(
+            addresses_to,
+            ctx_dict,
+            subject_template,
+            body_template,
+            body_html_template,
+            lane=lane,
+        )
+    )
+
 
+def build_email(
+    addresses_to,
+    ctx_dict,
+    subject_template,
+    body_template,
+    body_html_template,
+    request=None,
+    lane=ACTIVATION_LANE,
+):
+    """
+    Function that renders an email, returning an ``EmailMultiAlternatives``
+    delivered in ``lane``
+    """
+    start = time.perf_counter()
+    subject, message_txt, message_html = render_email(
+        subject_template, body_template, body_html_template, ctx_dict, request
+    )
+    signals.email_rendered.send(
+        sender=EmailMultiAlternatives,
+        template_name=body_template,
+        duration=time.perf_counter() - start,
+    )
     prefix = getattr(settings, "REGISTRATION_EMAIL_SUBJECT_PREFIX", "")
-    subject = f"{prefix}{render_to_string(subject_template, ctx_dict)}"
+    subject = f"{prefix}{subject}"
     # Email subject *must not* contain newlines. It also replaces extra
     # spaces between words by as single space.
     subject = " ".join(subject.split())
     from_email = get_from_email(ctx_dict.get("site"))
-    message_txt = render_to_string(body_template, ctx_dict)
 
     email_message = EmailMultiAlternatives(
         subject, message_txt, from_email, addresses_to
     )
+    if message_html is not None:
+        email_message.attach_alternative(message_html, "text/html")
+    # Identifies the email in the ``email_sent`` signal.
+    email_message.template_name = body_template
+    email_message.lane = lane
 
-    if getattr(settings, "REGISTRATION_EMAIL_HTML", True):
-        try:
-            message_html = render_to_string(body_html_template, ctx_dict)
-        except TemplateDoesNotExist:
-            pass
-        else:
-            email_message.attach_alternative(message_html, "text/html")
-
-    email_message.send()
+    return email_message
 
 
 class RegistrationManager(models.Manager):
@@ -96,23 +277,185 @@ class RegistrationManager(models.Manager):
 
     """
 
+    def with_user(self):
+        """
+        Return the profiles along with their user, fetched in the same query.
+
+        By default every field of the user is loaded. When the
+        ``REGISTRATION_USER_FIELDS`` setting lists user field names, only
+        these are loaded along with the primary key, ``USERNAME_FIELD``,
+        email field and ``is_active`` of the user; other fields are loaded
+        on access.
+        """
+        queryset = self.select_related("user")
+        user_fields = getattr(settings, "REGISTRATION_USER_FIELDS", None)
+        if user_fields is None:
+            return queryset
+        user_fields = {
+            User._meta.pk.name,
+            User.USERNAME_FIELD,
+            User.get_email_field_name(),
+            "is_active",
+            *user_fields,
+        }
+        return queryset.only(
+            *(field.name for field in self.model._meta.concrete_fields),
+            *(f"user__{name}" for name in user_fields),
+        )
+
+    def _mark_activated(self, profile):
+        """
+        Flag the ``RegistrationProfile`` given as argument as activated.
+
+        The flag is flipped with a single conditional ``UPDATE`` so that
+        only one of several concurrent activations of the same profile
+        wins. Return ``True`` if this call activated the profile, ``False``
+        if it was already activated.
+        """
+        updated = RegistrationProfile.objects.filter(
+            pk=profile.pk, activated=False
+        ).update(activated=True)
+        profile.activated = True
+        return updated == 1
+
+    async def _amark_activated(self, profile):
+        """
+        Asynchronous version of ``_mark_activated``.
+        """
+        updated = await RegistrationProfile.objects.filter(
+            pk=profile.pk, activated=False
+        ).aupdate(activated=True)
+        profile.activated = True
+        return updated == 1
+
     def _activate(self, profile, site, get_profile):
         """
         Activate the ``RegistrationProfile`` given as argument.
         User is able to login, as ``is_active`` is set to ``True``
+
+        Return ``False`` if the profile was activated concurrently.
         """
+        with transaction.atomic():
+            if not self._mark_activated(profile):
+                return False
+            User._default_manager.filter(pk=profile.user_id).update(is_active=True)
+
         user = profile.user
         user.is_active = True
-        profile.activated = True
-
-        with transaction.atomic():
-            user.save()
-            profile.save()
         if get_profile:
             return profile
         else:
             return user
 
+    async def _aactivate(self, profile, site, get_profile):
+        """
+        Asynchronous version of ``_activate``.
+
+        Django does not run transactions from asynchronous code yet, so the
+        two updates are made in a thread.
+        """
+        return await sync_to_async(self._activate)(profile, site, get_profile)
+
+    def _parse_activation_key(self, activation_key):
+        """
+        Return the lookup of the ``RegistrationProfile`` matching
+        ``activation_key`` and the fingerprint of its key (``None`` unless
+        the key is signed), or ``None`` if no profile can match.
+
+        When ``REGISTRATION_SIGNED_ACTIVATION_KEYS`` is set, the activation
+        key is a token signed by ``RegistrationProfile.get_activation_key``.
+        Its signature and the expiration date it holds are verified before
+        looking up the profile, so forged or outdated tokens never reach the
+        database.
+
+        Keys which did not match any profile are remembered in the
+        registration cache by the callers, so retrying them does not query
+        the database again.
+        """
+        fingerprint = None
+        if getattr(settings, "REGISTRATION_SIGNED_ACTIVATION_KEYS", False):
+            try:
+                profile_id, fingerprint, expires_at = signing.loads(
+                    activation_key, salt=ACTIVATION_KEY_SALT
+                )
+            except (signing.BadSignature, TypeError, ValueError):
+                return None
+            if expires_at <= timezone.now().timestamp():
+                return None
+            lookup = {"pk": profile_id}
+        else:
+            # Make sure the key we're trying conforms to the pattern of a
+            # SHA256 hash; if it doesn't, no point trying to look it up in
+            # the database.
+            if not SHA256_RE.search(activation_key):
+                return None
+            # Keys may be stored in either form while they are converted by
+            # the ``convertactivationkeys`` command.
+            lookup = {
+                "activation_key__in": {
+                    encode_activation_key(activation_key, "hex"),
+                    encode_activation_key(activation_key, "base64"),
+                }
+            }
+
+        return lookup, fingerprint
+
+    def _check_activation_profile(self, activation_key, profile, fingerprint):
+        """
+        Return ``profile``, the result of the lookup of ``activation_key``,
+        unless its key does not match ``fingerprint``; in that case return
+        ``None``.
+        """
+        # The key of the profile changes when the activation email is sent
+        # again, which invalidates the tokens issued before.
+        if (
+            profile is not None
+            and fingerprint is not None
+            and not constant_time_compare(
+                fingerprint,
+                decode_activation_key(profile.activation_key)[
+                    :ACTIVATION_KEY_FINGERPRINT_LENGTH
+                ],
+            )
+        ):
+            profile = None
+        return profile
+
+    def _get_activation_profile(self, activation_key):
+        """
+        Return the ``RegistrationProfile`` matching ``activation_key``, with
+        its user, or ``None`` if there is none.
+        """
+        parsed = self._parse_activation_key(activation_key)
+        if parsed is None or is_unknown_activation_key(activation_key):
+            return None
+        lookup, fingerprint = parsed
+        try:
+            profile = self.with_user().get(**lookup)
+        except self.model.DoesNotExist:
+            profile = None
+        profile = self._check_activation_profile(activation_key, profile, fingerprint)
+        if profile is None:
+            remember_unknown_activation_key(activation_key)
+        return profile
+
+    async def _aget_activation_profile(self, activation_key):
+        """
+        Asynchronous version of ``_get_activation_profile``.
+        """
+        parsed = self._parse_activation_key(activation_key)
+        if parsed is None or await ais_unknown_activation_key(activation_key):
+            return None
+        lookup, fingerprint = parsed
+        try:
+            profile = await self.with_user().aget(**lookup)
+        except self.model.DoesNotExist:
+            profile = None
+        profile = self._check_activation_profile(activation_key, profile, fingerprint)
+        if profile is None:
+            await aremember_unknown_activation_key(activation_key)
+        return profile
+
     def activate_user(self, activation_key, site, get_profile=False):
         """
         Validate an activation key and activate the corresponding ``User`` if
@@ -136,28 +479,43 @@ class RegistrationManager(models.Manager):
         is set to ``True`` after successful activation.
 
         """
-        # Make sure the key we're trying conforms to the pattern of a
-        # SHA256 hash; if it doesn't, no point trying to look it up in
-        # the database.
-        # The or statement is used
-        if SHA256_RE.search(activation_key):
-            try:
-                profile = self.get(activation_key=activation_key)
-            except self.model.DoesNotExist:
-                # This is an actual activation failure as the activation
-                # key does not exist. It is *not* the scenario where an
-                # already activated User reuses an activation key.
-                return (False, False)
+        profile = self._get_activation_profile(activation_key)
+        if profile is None:
+            # This is an actual activation failure as the activation
+            # key does not exist. It is *not* the scenario where an
+            # already activated User reuses an activation key.
+            return (False, False)
+
+        if profile.activated:
+            # The User has already activated and is trying to activate
+            # again. If the User is active, return the User. Else,
+            # return False as the User has been deactivated by a site
+            # administrator.
+            return (profile.user, False)
+
+        if not profile.activation_key_expired():
+            if activated := self._activate(profile, site, get_profile):
+                return (activated, True)
+            # Another request activated the profile in the meantime.
+            return (profile.user, False)
 
-            if profile.activated:
-                # The User has already activated and is trying to activate
-                # again. If the User is active, return the User. Else,
-                # return False as the User has been deactivated by a site
-                # administrator.
-                return (profile.user, False)
+        return (False, False)
+
+    async def aactivate_user(self, activation_key, site, get_profile=False):
+        """
+        Asynchronous version of ``activate_user``.
+        """
+        profile = await self._aget_activation_profile(activation_key)
+        if profile is None:
+            return (False, False)
+
+        if profile.activated:
+            return (profile.user, False)
 
-            if not profile.activation_key_expired():
-                return (self._activate(profile, site, get_profile), True)
+        if not profile.activation_key_expired():
+            if activated := await self._aactivate(profile, site, get_profile):
+                return (activated, True)
+            return (profile.user, False)
 
         return (False, False)
 
@@ -167,7 +525,8 @@ class RegistrationManager(models.Manager):
         new_user=None,
         send_email=True,
         request=None,
-        profile_info={},
+        profile_info=None,
+        activation_window=None,
         **user_info,
     ):
         """
@@ -180,6 +539,89 @@ class RegistrationManager(models.Manager):
         Additionally, if email is sent and ``request`` is supplied,
         it will be passed to the email template.
 
+        ``activation_window`` is an optional ``datetime.timedelta`` during
+        which this user may activate their account, instead of
+        ``ACCOUNT_ACTIVATION_DAYS``.
+
+        """
+        profile_info = profile_info or {}
+        queue_email = send_email and get_email_delivery() == "outbox"
+        new_user, registration_profile = self._create_inactive_user(
+            site,
+            request,
+            new_user,
+            profile_info,
+            activation_window,
+            send_email,
+            queue_email,
+            **user_info,
+        )
+
+        # send email only if desired and transaction succeeds
+        if send_email and not queue_email:
+            transaction.on_commit(
+                lambda: registration_profile.send_activation_email(site, request)
+            )
+
+        return new_user
+
+    async def acreate_inactive_user(
+        self,
+        site,
+        new_user=None,
+        send_email=True,
+        request=None,
+        profile_info=None,
+        activation_window=None,
+        **user_info,
+    ):
+        """
+        Asynchronous version of ``create_inactive_user``.
+
+        The user and its profile are saved in a thread, as Django does not
+        run transactions from asynchronous code yet; the activation email is
+        sent once they are committed.
+        """
+        profile_info = profile_info or {}
+        queue_email = send_email and get_email_delivery() == "outbox"
+        new_user, registration_profile = await sync_to_async(
+            self._create_inactive_user
+        )(
+            site,
+            request,
+            new_user,
+            profile_info,
+            activation_window,
+            send_email,
+            queue_email,
+            **user_info,
+        )
+
+        if send_email and not queue_email:
+            await sync_to_async(registration_profile.send_activation_email)(
+                site, request
+            )
+
+        return new_user
+
+    def _create_inactive_user(
+        self,
+        site,
+        request,
+        new_user,
+        profile_info,
+        activation_window,
+        send_email,
+        queue_email,
+        **user_info,
+    ):
+        """
+        Save a new, inactive ``User`` and its ``RegistrationProfile`` in a
+        transaction, and return both.
+
+        If ``send_email`` is set, the profile records the activation email as
+        sent now. If ``queue_email`` is set, the activation email is written
+        to the outbox in the same transaction.
         """
         if new_user is None:
             password = user_info.pop("password")
@@ -190,26 +632,28 @@ class RegistrationManager(models.Manager):
         # Since we calculate the RegistrationProfile expiration from this date,
         # we want to ensure that it is current
         new_user.date_joined = timezone.now()
+        if send_email:
+            profile_info = {"last_sent_at": new_user.date_joined, **profile_info}
 
         with transaction.atomic():
             new_user.save()
-            registration_profile = self.create_profile(new_user, **profile_info)
-
-            # send email only if desired and transaction succeeds
-            if send_email:
-                transaction.on_commit(
-                    lambda: registration_profile.send_activation_email(site, request)
-                )
+            registration_profile = self.create_profile(
+                new_user, activation_window=activation_window, **profile_info
+            )
+            if queue_email:
+                registration_profile.send_activation_email(site, request)
 
-        return new_user
+        return new_user, registration_profile
 
-    def create_profile(self, user, **profile_info):
+    def create_profile(self, user, activation_window=None, **profile_info):
         """
         Create a ``RegistrationProfile`` for a given
         ``User``, and return the ``RegistrationProfile``.
 
         The activation key for the ``RegistrationProfile`` will be a
-        SHA256 hash, generated from a secure random string.
+        SHA256 hash, generated from a secure random string. The key expires
+        once ``activation_window`` (a ``datetime.timedelta``, defaulting to
+        ``ACCOUNT_ACTIVATION_DAYS`` days) has passed since the user joined.
 
         """
         profile = self.model(user=user, **profile_info)
@@ -217,30 +661,188 @@ class RegistrationManager(models.Manager):
         if "activation_key" not in profile_info:
             profile.create_new_activation_key(save=False)
 
+        if profile.expires_at is None:
+            if activation_window is None:
+                activation_window = datetime.timedelta(
+                    days=settings.ACCOUNT_ACTIVATION_DAYS
+                )
+            profile.expires_at = user.date_joined + activation_window
+
         profile.save()
 
         return profile
 
+    def _expired_q(self, now):
+        """
+        Return the ``Q`` object matching profiles whose activation key has
+        expired at ``now``.
+
+        Profiles lacking ``expires_at``, which ``RegistrationProfile.save``
+        sets, never match until ``backfill_expires_at`` gives them one.
+        """
+        return models.Q(expires_at__lte=now)
+
+    def backfill_expires_at(self, batch_size=None):
+        """
+        Set the ``expires_at`` of the profiles lacking it, updated without
+        ``RegistrationProfile.save``, to the date their user joined plus
+        ``ACCOUNT_ACTIVATION_DAYS``. Return the number of profiles updated.
+
+        Like the ``0009_backfill_expires_at`` migration, profiles are updated
+        ``batch_size`` at a time, ``REGISTRATION_CLEANUP_BATCH_SIZE`` (1000)
+        by default, each batch in its own transaction, walking their ids.
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, "REGISTRATION_CLEANUP_BATCH_SIZE", 1000)
+        using = self._db or router.db_for_write(self.model)
+        activation_window = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        profiles = (
+            self.db_manager(using)
+            .filter(expires_at=None)
+            .exclude(user=None)
+            .select_related("user")
+            .only("pk", "expires_at", "user__date_joined")
+            .order_by("pk")
+        )
+        updated_count = 0
+        last_pk = 0
+        while batch := list(profiles.filter(pk__gt=last_pk)[:batch_size]):
+            for profile in batch:
+                profile.expires_at = profile.user.date_joined + activation_window
+            with transaction.atomic(using=using):
+                self.db_manager(using).bulk_update(batch, ["expires_at"])
+            updated_count += len(batch)
+            last_pk = batch[-1].pk
+        return updated_count
+
+    def pending(self):
+        """
+        Return the profiles which are not activated yet and whose activation
+        key has not expired.
+        """
+        return self.filter(activated=False, expires_at__gt=timezone.now())
+
+    def expired(self):
+        """
+        Return the profiles which are not activated and whose activation key
+        has expired.
+        """
+        return self.filter(self._expired_q(timezone.now()), activated=False)
+
+    def _resend_allowed(self, profile, now):
+        """
+        Return whether the activation email of ``profile`` may be sent again
+        at ``now``: the profile can still be activated, and the last email
+        was sent more than ``REGISTRATION_RESEND_COOLDOWN`` seconds ago.
+        """
+        if profile.activated or profile.activation_key_expired():
+            return False
+        return profile.last_sent_at is None or (
+            profile.last_sent_at <= self._resend_cutoff(now)
+        )
+
+    def _resend_cutoff(self, now):
+        cooldown = getattr(settings, "REGISTRATION_RESEND_COOLDOWN", 60)
+        return now - datetime.timedelta(seconds=cooldown)
+
+    def _resend_claim(self, profile, now):
+        """
+        Return the queryset whose ``update`` claims the resend of the
+        activation email of ``profile`` at ``now``.
+
+        The claim is a single conditional ``UPDATE`` of ``last_sent_at``,
+        so that only one of several concurrent resends updates a row and
+        sends the email.
+        """
+        return self.filter(
+            models.Q(last_sent_at=None)
+            | models.Q(last_sent_at__lte=self._resend_cutoff(now)),
+            pk=profile.pk,
+            activated=False,
+        )
+
     def resend_activation_mail(self, email, site, request=None):
         """
         Resets activation key for the user and resends activation email.
+
+        Nothing is written or sent while the previous activation email is
+        younger than ``REGISTRATION_RESEND_COOLDOWN`` seconds.
         """
         try:
-            profile = self.get(user__email__iexact=email)
+            profile = self.with_user().get(user__email__iexact=email)
         except ObjectDoesNotExist:
             return False
         except MultipleObjectsReturned:
             return False
 
-        if profile.activated or profile.activation_key_expired():
+        now = timezone.now()
+        if not self._resend_allowed(profile, now):
             return False
 
-        profile.create_new_activation_key()
+        profile.create_new_activation_key(save=False)
+        claimed = self._resend_claim(profile, now).update(
+            activation_key=profile.activation_key, last_sent_at=now
+        )
+        if not claimed:
+            return False
+        profile.last_sent_at = now
         profile.send_activation_email(site, request)
 
         return True
 
-    def delete_expired_users(self):
+    async def aresend_activation_mail(self, email, site, request=None):
+        """
+        Asynchronous version of ``resend_activation_mail``.
+        """
+        try:
+            profile = await self.with_user().aget(user__email__iexact=email)
+        except ObjectDoesNotExist:
+            return False
+        except MultipleObjectsReturned:
+            return False
+
+        now = timezone.now()
+        if not self._resend_allowed(profile, now):
+            return False
+
+        profile.create_new_activation_key(save=False)
+        claimed = await self._resend_claim(profile, now).aupdate(
+            activation_key=profile.activation_key, last_sent_at=now
+        )
+        if not claimed:
+            return False
+        profile.last_sent_at = now
+        await sync_to_async(profile.send_activation_email)(site, request)
+
+        return True
+
+    def resend_activation_mails(self, profiles, site, request=None):
+        """
+        Reset the activation key of the ``profiles`` which can still be
+        activated and send their activation emails together, see
+        ``deliver_emails``. Return the number of emails sent.
+
+        ``profiles`` should fetch their user, e.g. ``with_user()``. As it is
+        meant for site administrators, ``REGISTRATION_RESEND_COOLDOWN`` does
+        not apply.
+        """
+        now = timezone.now()
+        profiles = [
+            profile
+            for profile in profiles
+            if not (profile.activated or profile.activation_key_expired())
+        ]
+        for profile in profiles:
+            profile.create_new_activation_key(save=False)
+            profile.last_sent_at = now
+        with transaction.atomic():
+            self.bulk_update(profiles, ["activation_key", "last_sent_at"])
+        deliver_emails(
+            [profile.get_activation_email(site, request) for profile in profiles]
+        )
+        return len(profiles)
+
+    def delete_expired_users(self, batch_size=None):
         """
         Remove expired instances of ``RegistrationProfile`` and their
         associated ``User``s.
@@ -278,26 +880,137 @@ class RegistrationManager(models.Manager):
         does not have an associated ``RegistrationProfile`` will not
         be deleted.
 
+        The expired profiles are selected in SQL and deleted with their users
+        ``batch_size`` at a time, ``REGISTRATION_CLEANUP_BATCH_SIZE`` (1000)
+        by default, each batch in its own transaction. Return the number of
+        profiles deleted.
+
+        The profiles lacking ``expires_at`` are first given one by
+        ``backfill_expires_at``.
+
+        """
+        self.backfill_expires_at(batch_size)
+        return sum(self.delete_expired_batches(batch_size))
+
+    async def adelete_expired_users(self, batch_size=None):
+        """
+        Asynchronous version of ``delete_expired_users``.
+        """
+        return await sync_to_async(self.delete_expired_users)(batch_size)
+
+    def delete_expired_batches(
+        self, batch_size=None, archive=None, min_pk=None, max_pk=None
+    ):
+        """
+        Delete the expired profiles and their users like
+        ``delete_expired_users``, yielding the number of profiles deleted
+        after each batch is committed. Stopping the iteration stops the
+        deletion; the remaining profiles are deleted by the next call.
+
+        ``archive`` is called with each batch, the ``(profile id, user id)``
+        to delete, before it is deleted; the batch is kept if it raises.
+        ``min_pk`` and ``max_pk`` restrict the deletion to a range of
+        profile ids, so several processes can share a cleanup.
+
+        The profiles are read from and deleted in the database of the
+        manager, e.g. ``db_manager("other")``, or the database for writes.
+
+        Each batch is logged at the INFO level, with the number of profiles
+        deleted, range of ids and duration. A ``REGISTRATION_CLEANUP_LOG_SAMPLE_RATE`` share of the
+        deleted profiles (none by default) is logged at the DEBUG level.
         """
-        profiles = self.filter(
+        if batch_size is None:
+            batch_size = getattr(settings, "REGISTRATION_CLEANUP_BATCH_SIZE", 1000)
+        using = self._db or router.db_for_write(self.model)
+        manager = self.db_manager(using)
+        last_pk = None
+        while True:
+            start = time.perf_counter()
+            with transaction.atomic(using=using):
+                batch = manager.expired_batch(batch_size, last_pk, min_pk, max_pk)
+                if not batch:
+                    return
+                if archive is not None:
+                    archive(batch)
+                deleted_count = manager.delete_expired_batch(batch)
+            last_pk = batch[-1][0]
+            logger.info(
+                "Deleted %d expired registration profiles, ids %s to %s, in %.3fs.",
+                deleted_count,
+                batch[0][0],
+                last_pk,
+                time.perf_counter() - start,
+            )
+            yield deleted_count
+
+    def deletable(self):
+        """
+        Return the profiles ``delete_expired_users`` deletes: the expired
+        profiles whose user is inactive or missing.
+        """
+        return self.expired().filter(
             models.Q(user__is_active=False) | models.Q(user=None),
-            activated=False,
         )
-        deleted_count = 0
-        for profile in profiles:
-            try:
-                if profile.activation_key_expired():
-                    user = profile.user
-                    msg = f"Deleting expired Registration profile {profile} and user {user}."
-                    logger.warning(msg)
-                    profile.delete()
-                    user.delete()
-                    deleted_count += 1
-            except User.DoesNotExist:
-                logger.warning(f"Deleting expired Registration profile {profile}")
-                profile.delete()
-                deleted_count += 1
-        return deleted_count
+
+    def count_deletable(self):
+        """
+        Return the number of profiles ``delete_expired_users`` would delete,
+        in a single query, counting the profiles lacking ``expires_at`` as
+        expired when ``backfill_expires_at`` would make them so.
+        """
+        now = timezone.now()
+        activation_window = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        return self.filter(
+            self._expired_q(now)
+            | models.Q(expires_at=None, user__date_joined__lte=now - activation_window),
+            models.Q(user__is_active=False) | models.Q(user=None),
+            activated=False,
+        ).count()
+
+    def expired_batch(self, batch_size, last_pk=None, min_pk=None, max_pk=None):
+        """
+        Return the ``(profile id, user id)`` of the next ``batch_size``
+        profiles to be deleted by ``delete_expired_users``, in the order of
+        their ids, after ``last_pk`` and between ``min_pk`` and ``max_pk``
+        if given.
+        """
+        profiles = self.deletable()
+        if last_pk is not None:
+            profiles = profiles.filter(pk__gt=last_pk)
+        if min_pk is not None:
+            profiles = profiles.filter(pk__gte=min_pk)
+        if max_pk is not None:
+            profiles = profiles.filter(pk__lte=max_pk)
+        return list(profiles.order_by("pk").values_list("pk", "user_id")[:batch_size])
+
+    def delete_expired_batch(self, batch):
+        """
+        Delete the profiles and users of ``batch``, a list of
+        ``(profile id, user id)`` returned by ``expired_batch``. Return the
+        number of profiles deleted.
+        """
+        sample_rate = getattr(settings, "REGISTRATION_CLEANUP_LOG_SAMPLE_RATE", 0)
+        if sample_rate and logger.isEnabledFor(logging.DEBUG):
+            for profile_id, user_id in batch:
+                if random.random() < sample_rate:
+                    logger.debug(
+                        "Deleting expired registration profile id=%s and user id=%s.",
+                        profile_id,
+                        user_id,
+                    )
+        # A profile activated, or a user activated, since the batch was
+        # selected is kept: so is the user of a profile kept.
+        _, deleted = self.filter(
+            models.Q(user__is_active=False) | models.Q(user=None),
+            pk__in=[profile_id for profile_id, _ in batch],
+            activated=False,
+        ).delete()
+        User._default_manager.db_manager(self._db).filter(
+            pk__in=[user_id for _, user_id in batch],
+            is_active=False,
+            registrationprofile=None,
+        ).delete()
+        return deleted.get(self.model._meta.label, 0)
 
 
 class RegistrationProfile(models.Model):
@@ -322,8 +1035,14 @@ class RegistrationProfile(models.Model):
         on_delete=models.CASCADE,
         verbose_name=_("user"),
     )
-    activation_key = models.CharField(_("activation key"), max_length=64)
+    activation_key = models.CharField(_("activation key"), max_length=64, unique=True)
     activated = models.BooleanField(default=False)
+    expires_at = models.DateTimeField(
+        _("activation key expiration date"), null=True, blank=True, db_index=True
+    )
+    last_sent_at = models.DateTimeField(
+        _("activation email last sent at"), null=True, blank=True
+    )
 
     objects = RegistrationManager()
 
@@ -334,18 +1053,49 @@ class RegistrationProfile(models.Model):
     def __str__(self):
         return f"Registration information for {self.user}"
 
+    def save(self, *args, **kwargs):
+        # Profiles created without ``create_profile`` expire like the ones it
+        # creates, so ``expired()`` and ``pending()`` find them.
+        if self.expires_at is None and self.user_id is not None:
+            self.expires_at = self.get_expiration_date()
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "expires_at"}
+        super().save(*args, **kwargs)
+
     def create_new_activation_key(self, save=True):
         """
         Create a new activation key for the user
         """
         random_string = get_random_string(length=32, allowed_chars=string.printable)
-        self.activation_key = hashlib.sha256(random_string.encode()).hexdigest()
+        self.activation_key = encode_activation_key(
+            hashlib.sha256(random_string.encode()).hexdigest()
+        )
 
         if save:
-            self.save()
+            self.save(update_fields=["activation_key"])
 
         return self.activation_key
 
+    def get_activation_key(self):
+        """
+        Return the key to send to the user in the activation link.
+
+        This is the activation key itself, in hexadecimal, unless the
+        ``REGISTRATION_SIGNED_ACTIVATION_KEYS`` setting is set. In that case
+        it is a token signed with ``SECRET_KEY``, holding the id of this
+        profile, the start of its activation key, its expiration date and
+        the time it was issued.
+        """
+        activation_key = decode_activation_key(self.activation_key)
+        if not getattr(settings, "REGISTRATION_SIGNED_ACTIVATION_KEYS", False):
+            return activation_key
+        fingerprint = activation_key[:ACTIVATION_KEY_FINGERPRINT_LENGTH]
+        expires_at = int(self.get_expiration_date().timestamp())
+        return signing.dumps(
+            [self.pk, fingerprint, expires_at], salt=ACTIVATION_KEY_SALT
+        )
+
     def activation_key_expired(self):
         """
         Determine whether this ``RegistrationProfile``'s activation
@@ -358,18 +1108,26 @@ class RegistrationProfile(models.Model):
            be ``True``. Re-activating is not permitted, and so this
            method returns ``True`` in this case.
 
-        2. Otherwise, the date the user signed up is incremented by
-           the number of days specified in the setting
-           ``ACCOUNT_ACTIVATION_DAYS`` (which should be the number of
-           days after signup during which a user is allowed to
-           activate their account); if the result is less than or
-           equal to the current date, the key has expired and this
-           method returns ``True``.
+        2. Otherwise, if ``self.expires_at`` is less than or equal to the
+           current date, the key has expired and this method returns
+           ``True``. ``expires_at`` is set by ``create_profile`` to the date
+           the user signed up incremented by the number of days specified in
+           the setting ``ACCOUNT_ACTIVATION_DAYS`` (which should be the number
+           of days after signup during which a user is allowed to activate
+           their account).
+
+        """
+        return self.activated or self.get_expiration_date() <= timezone.now()
 
+    def get_expiration_date(self):
         """
+        Return the date at which the activation key expires.
+        """
+        if self.expires_at is not None:
+            return self.expires_at
+        # Profiles not saved yet, or updated without ``save``.
         max_expiry_days = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
-        expiration_date = self.user.date_joined + max_expiry_days
-        return self.activated or expiration_date <= timezone.now()
+        return self.user.date_joined + max_expiry_days
 
     def send_activation_email(self, site, request=None):
         """
@@ -400,12 +1158,16 @@ class RegistrationProfile(models.Model):
             The new user account
 
         ``activation_key``
-            The activation key for the new account.
+            The activation key for the new account, as returned by
+            ``get_activation_key``.
 
         ``expiration_days``
             The number of days remaining during which the account may
             be activated.
 
+        ``expiration_date``
+            The date at which the activation key expires.
+
         ``site``
             An object representing the site on which the user
             registered; depending on whether ``django.contrib.sites``
@@ -421,6 +1183,13 @@ class RegistrationProfile(models.Model):
             If supplied will be passed to the template for better
             flexibility via ``RequestContext``.
         """
+        deliver_email(self.get_activation_email(site, request))
+
+    def get_activation_email(self, site, request=None):
+        """
+        Return the activation email, an ``EmailMultiAlternatives`` rendered
+        as described in ``send_activation_email``, without sending it.
+        """
         activation_email_subject = getattr(
             settings,
             "ACTIVATION_EMAIL_SUBJECT",
@@ -435,38 +1204,24 @@ class RegistrationProfile(models.Model):
             "registration/activation_email.html",
         )
 
+        expiration_date = self.get_expiration_date()
+        remaining = max(expiration_date - timezone.now(), datetime.timedelta(0))
         ctx_dict = {
             "user": self.user,
-            "activation_key": self.activation_key,
-            "expiration_days": settings.ACCOUNT_ACTIVATION_DAYS,
+            "activation_key": self.get_activation_key(),
+            "expiration_days": math.ceil(remaining / datetime.timedelta(days=1)),
+            "expiration_date": expiration_date,
             "site": site,
         }
-        prefix = getattr(settings, "REGISTRATION_EMAIL_SUBJECT_PREFIX", "")
-        subject = render_to_string(activation_email_subject, ctx_dict, request=request)
-        subject = f"{prefix}{subject}"
-
-        # Email subject *must not* contain newlines. It also replaces extra
-        # spaces between words by as single space.
-        subject = " ".join(subject.split())
-        from_email = get_from_email(site)
-        message_txt = render_to_string(activation_email_body, ctx_dict, request=request)
-
-        email_message = EmailMultiAlternatives(
-            subject, message_txt, from_email, [self.user.email]
+        return build_email(
+            [self.user.email],
+            ctx_dict,
+            activation_email_subject,
+            activation_email_body,
+            activation_email_html,
+            request=request,
         )
 
-        if getattr(settings, "REGISTRATION_EMAIL_HTML", True):
-            try:
-                message_html = render_to_string(
-                    activation_email_html, ctx_dict, request=request
-                )
-            except TemplateDoesNotExist:
-                pass
-            else:
-                email_message.attach_alternative(message_html, "text/html")
-
-        email_message.send()
-
 
 class SupervisedRegistrationManager(RegistrationManager):
     def activation_key_expired(self):
@@ -481,35 +1236,51 @@ class SupervisedRegistrationManager(RegistrationManager):
         `self.user.is_active`` will be ``True``.  Re-activating is not
         permitted, and so this method returns ``True`` in this case.
 
-        2. Otherwise, the date the user signed up is incremented by the number
-        of days specified in the setting ``ACCOUNT_ACTIVATION_DAYS`` (which
-        should be the number of days after signup during which a user is
-        allowed to activate their account); if the result is less than or equal
+        2. Otherwise, if ``self.expires_at`` (see
+        ``RegistrationProfile.activation_key_expired``) is less than or equal
         to the current date, the key has expired and this method returns
         ``True``.
         """
-        expiration_date = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
         # A user is only considered activated when the entire registration
         # process is completed (i.e. an admin has approved the account)
         is_activated = self.activated and self.user.is_active
-        return is_activated or self.user.date_joined + expiration_date <= timezone.now()
+        return is_activated or self.get_expiration_date() <= timezone.now()
 
     def _activate(self, profile, site, get_profile):
         """
         Activate the ``SupervisedRegistrationProfile`` given as argument.
 
-        Send an email to the site administrators to approve the user.
+        Send an email to the site administrators to approve the user, unless
+        the ``REGISTRATION_ADMIN_APPROVAL_DIGEST`` setting is set; the user
+        is then listed in the next digest, see ``send_admin_approve_digest``.
 
         User is not able to login yet, as ``is_active`` is not yet ``True``
+
+        Return ``False`` if the profile was activated concurrently.
         """
+        # do not set ``User.is_active`` as True. This will be set
+        # when a site administrator approves this account.
+        if not self._mark_activated(profile):
+            return False
 
-        if not profile.user.is_active and not profile.activated:
+        if not profile.user.is_active and not get_admin_approval_digest():
             self.send_admin_approve_email(profile.user, site)
 
-        # do not set ``User.is_active`` as True. This will be set
-        # when a site administrator approves this account.
-        profile.activated = True
-        profile.save()
+        if get_profile:
+            return profile
+        else:
+            return profile.user
+
+    async def _aactivate(self, profile, site, get_profile):
+        """
+        Asynchronous version of ``_activate``.
+        """
+        if not await self._amark_activated(profile):
+            return False
+
+        if not profile.user.is_active and not get_admin_approval_digest():
+            await sync_to_async(self.send_admin_approve_email)(profile.user, site)
+
         if get_profile:
             return profile
         else:
@@ -532,7 +1303,7 @@ class SupervisedRegistrationManager(RegistrationManager):
         object is not activated, return ``False``.
         """
         try:
-            profile = SupervisedRegistrationProfile.objects.get(id=profile_id)
+            profile = self.with_user().get(id=profile_id)
             if profile.activated and profile.user.is_active:
                 return profile.user
 
@@ -541,10 +1312,12 @@ class SupervisedRegistrationManager(RegistrationManager):
             # this process)
             if profile.activated:
                 profile.user.is_active = True
+                profile.approved_at = timezone.now()
             else:
                 return False
 
-            profile.user.save()
+            profile.user.save(update_fields=["is_active"])
+            self.filter(pk=profile.pk).update(approved_at=profile.approved_at)
             profile.send_admin_approve_complete_email(site, request)
 
             if get_profile:
@@ -554,6 +1327,114 @@ class SupervisedRegistrationManager(RegistrationManager):
         except self.model.DoesNotExist:
             return False
 
+    async def aadmin_approve_user(
+        self, profile_id, site, get_profile=False, request=None
+    ):
+        """
+        Asynchronous version of ``admin_approve_user``.
+        """
+        try:
+            profile = await self.with_user().aget(id=profile_id)
+        except self.model.DoesNotExist:
+            return False
+
+        if profile.activated and profile.user.is_active:
+            return profile.user
+
+        if not profile.activated:
+            return False
+
+        profile.user.is_active = True
+        profile.approved_at = timezone.now()
+        await profile.user.asave(update_fields=["is_active"])
+        await self.filter(pk=profile.pk).aupdate(approved_at=profile.approved_at)
+        await sync_to_async(profile.send_admin_approve_complete_email)(site, request)
+
+        if get_profile:
+            return profile
+        else:
+            return profile.user
+
+    def awaiting_approval(self):
+        """
+        Return the profiles, with their user, which are activated and await
+        the approval of a site administrator: the users deactivated once
+        approved are left out.
+        """
+        return self.with_user().filter(
+            activated=True, user__is_active=False, approved_at=None
+        )
+
+    def send_admin_approve_digest(self, site):
+        """
+        Send one email to each site administrator listing the profiles
+        awaiting approval, and return the number of these profiles. Nothing
+        is sent when no profile awaits approval. Only the first
+        ``REGISTRATION_ADMIN_APPROVAL_DIGEST_LIMIT`` profiles (100 by
+        default) are listed.
+
+        The digest will use the following templates, which can be
+        overridden by setting ADMIN_APPROVAL_DIGEST_EMAIL_SUBJECT,
+        ADMIN_APPROVAL_DIGEST_EMAIL_BODY and ADMIN_APPROVAL_DIGEST_EMAIL_HTML:
+
+        ``registration/admin_approve_digest_email_subject.txt``
+            This template will be used for the subject line of the email.
+
+        ``registration/admin_approve_digest_email.txt``
+            This template will be used for the text body of the email.
+
+        ``registration/admin_approve_digest_email.html``
+            This template will be used for the html body of the email.
+
+        These templates will each receive the ``profiles`` listed, the
+        ``more_count`` of the profiles awaiting approval left out and the
+        ``site``.
+        """
+        limit = getattr(settings, "REGISTRATION_ADMIN_APPROVAL_DIGEST_LIMIT", 100)
+        awaiting_approval = self.awaiting_approval().order_by("pk")
+        profiles = list(awaiting_approval[:limit])
+        if not profiles:
+            return 0
+        profile_count = len(profiles)
+        if profile_count == limit:
+            profile_count = awaiting_approval.count()
+
+        admin_approve_digest_email_subject = getattr(
+            settings,
+            "ADMIN_APPROVAL_DIGEST_EMAIL_SUBJECT",
+            "registration/admin_approve_digest_email_subject.txt",
+        )
+        admin_approve_digest_email_body = getattr(
+            settings,
+            "ADMIN_APPROVAL_DIGEST_EMAIL_BODY",
+            "registration/admin_approve_digest_email.txt",
+        )
+        admin_approve_digest_email_html = getattr(
+            settings,
+            "ADMIN_APPROVAL_DIGEST_EMAIL_HTML",
+            "registration/admin_approve_digest_email.html",
+        )
+
+        ctx_dict = {
+            "profiles": profiles,
+            "more_count": profile_count - len(profiles),
+            "site": site,
+        }
+        deliver_emails(
+            [
+                build_email(
+                    [admin],
+                    ctx_dict,
+                    admin_approve_digest_email_subject,
+                    admin_approve_digest_email_body,
+                    admin_approve_digest_email_html,
+                    lane=NOTIFICATION_LANE,
+                )
+                for admin in get_registration_admins()
+            ]
+        )
+        return profile_count
+
     def send_admin_approve_email(self, user, site, request=None):
         """
         Send an approval email to the site administrators to
@@ -623,33 +1504,13 @@ class SupervisedRegistrationManager(RegistrationManager):
             "profile_id": user.registrationprofile.id,
             "site": site,
         }
-        registration_admins = getattr(settings, "REGISTRATION_ADMINS", None)
-        if isinstance(registration_admins, str):  # We have a getter
-            admins_getter = import_string(registration_admins)
-            admins = admins_getter()
-        else:
-            admins = registration_admins or getattr(settings, "ADMINS", None)
-        if not registration_admins:
-            warnings.warn(
-                "No registration admin defined in"
-                " settings.REGISTRATION_ADMINS."
-                " Using settings.ADMINS for the admin approval",
-                UserWarning,
-            )
-        if not admins:
-            raise ImproperlyConfigured(
-                "Using the admin_approval registration backend"
-                " requires at least one admin in settings.ADMINS"
-                " or settings.REGISTRATION_ADMINS"
-            )
-
-        admins = [admin[1] for admin in admins]
         send_email(
-            admins,
+            get_registration_admins(),
             ctx_dict,
             admin_approve_email_subject,
             admin_approve_email_body,
             admin_approve_email_html,
+            lane=NOTIFICATION_LANE,
         )
 
 
@@ -659,6 +1520,8 @@ class SupervisedRegistrationProfile(RegistrationProfile):
     # in admin approval
     objects = SupervisedRegistrationManager()
 
+    approved_at = models.DateTimeField(_("approved at"), null=True, blank=True)
+
     def send_admin_approve_complete_email(self, site, request=None):
         """
         Send an "approval is complete" email to the user associated with this
@@ -728,4 +1591,117 @@ class SupervisedRegistrationProfile(RegistrationProfile):
             admin_approve_complete_email_subject,
             admin_approve_complete_email_body,
             admin_approve_complete_email_html,
+            lane=NOTIFICATION_LANE,
+        )
+
+
+class OutboxEmailManager(models.Manager):
+    """
+    Custom manager for the ``OutboxEmail`` model.
+
+    """
+
+    def enqueue(self, email_message):
+        """
+        Write ``email_message``, an ``EmailMultiAlternatives``, to the outbox
+        and return the ``OutboxEmail``.
+        """
+        email = self._from_message(email_message)
+        email.save(force_insert=True)
+        return email
+
+    def enqueue_many(self, email_messages):
+        """
+        Write ``email_messages`` to the outbox in a single query.
+        """
+        return self.bulk_create(
+            [self._from_message(email_message) for email_message in email_messages]
+        )
+
+    def _from_message(self, email_message):
+        html_body = ""
+        for content, mimetype in email_message.alternatives:
+            if mimetype == "text/html":
+                html_body = content
+        return self.model(
+            subject=email_message.subject,
+            body=email_message.body,
+            html_body=html_body,
+            from_email=email_message.from_email,
+            to=list(email_message.to),
+            template_name=getattr(email_message, "template_name", ""),
+            priority=LANES.index(get_email_lane(email_message)),
+        )
+
+    def due(self, max_attempts, now=None, lane=None):
+        """
+        Return the emails which are not sent yet, have been attempted less
+        than ``max_attempts`` times and whose next attempt is due, the
+        activation emails first. ``lane`` restricts them to one lane.
+        """
+        if now is None:
+            now = timezone.now()
+        emails = self.filter(
+            sent_at=None, attempts__lt=max_attempts, next_attempt_at__lte=now
+        )
+        if lane is not None:
+            emails = emails.filter(priority=LANES.index(lane))
+        return emails.order_by("priority", "next_attempt_at", "pk")
+
+
+class OutboxEmail(models.Model):
+    """
+    A registration email waiting to be sent by the ``registration_mailworker``
+    management command.
+
+    Emails are only written here when the ``REGISTRATION_EMAIL_DELIVERY``
+    setting is ``"outbox"``. The activation email is then written in the
+    same transaction as the ``RegistrationProfile``, so it is sent if and
+    only if the registration is committed, without waiting for the mail
+    server during the request.
+
+    """
+
+    subject = models.CharField(_("subject"), max_length=255)
+    body = models.TextField(_("body"))
+    html_body = models.TextField(_("HTML body"), blank=True)
+    from_email = models.CharField(_("from"), max_length=254)
+    to = models.JSONField(_("to"))
+    template_name = models.CharField(_("template name"), max_length=255, blank=True)
+    priority = models.PositiveSmallIntegerField(
+        _("priority"),
+        default=0,
+        help_text=_("Emails of a lower priority are sent first."),
+    )
+    created_at = models.DateTimeField(_("created at"), default=timezone.now)
+    next_attempt_at = models.DateTimeField(_("next attempt at"), default=timezone.now)
+    attempts = models.PositiveIntegerField(_("attempts"), default=0)
+    last_error = models.TextField(_("last error"), blank=True)
+    sent_at = models.DateTimeField(_("sent at"), null=True, blank=True)
+
+    objects = OutboxEmailManager()
+
+    class Meta:
+        verbose_name = _("outbox email")
+        verbose_name_plural = _("outbox emails")
+        indexes = [models.Index(fields=["sent_at", "priority", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+
+    def get_message(self, connection=None):
+        """
+        Return the ``EmailMultiAlternatives`` to send for this email.
+        """
+        email_message = EmailMultiAlternatives(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.to,
+            connection=connection,
         )
+        if self.html_body:
+            email_message.attach_alternative(self.html_body, "text/html")
+        email_message.template_name = self.template_name
+        email_message.lane = LANES[self.priority]
+        return email_message
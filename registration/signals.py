@@ -12,6 +12,12 @@ user_registered = Signal()
 # A user has activated his or her account.
 user_activated = Signal()
 
+# A registration email has been rendered.
+email_rendered = Signal()
+
+# A registration email has been handed to the mail server, or failed to be.
+email_sent = Signal()
+
 
 def login_user(sender, user, request, **kwargs):
     """Automatically authenticate the user when activated"""
@@ -0,0 +1,135 @@
+"""
+A local SMTP server which accepts and discards emails, standing in for a
+real mail provider when measuring the registration email pipeline (see the
+``registration_loadtest`` command).
+
+The server runs an asyncio event loop in a background thread, so it can be
+used from synchronous code::
+
+    with SMTPSink(latency=0.05, failure_rate=0.1) as sink:
+        connection = get_connection(
+            "django.core.mail.backends.smtp.EmailBackend",
+            host=sink.host,
+            port=sink.port,
+        )
+
+``latency`` delays the answer to each email, and ``failure_rate`` is the
+probability that an email is refused with a temporary failure (a 451 reply),
+which the smtp email backend raises as ``SMTPDataError``.
+
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+
+class SMTPSink:
+    """
+    An SMTP server listening on ``host`` and ``port``, a free port by
+    default.
+
+    ``message_count`` and ``failure_count`` are the number of emails
+    accepted and refused, ``received_at`` the ``time.monotonic()`` at which
+    each email was accepted.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, failure_rate=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.message_count = 0
+        self.failure_count = 0
+        self.received_at = []
+        self._loop = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Start the server in a background thread, and return once it
+        listens.
+        """
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(started,),
+            name="registration-smtp-sink",
+            daemon=True,
+        )
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        """
+        Stop the server and close the connections still open.
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+            self._loop.close()
+
+    async def _handle(self, reader, writer):
+        writer.write(b"220 localhost registration SMTP sink\r\n")
+        try:
+            while line := await reader.readline():
+                verb = line.split(b" ", 1)[0].strip().upper()
+                match verb:
+                    case b"EHLO":
+                        writer.write(b"250-localhost\r\n250 8BITMIME\r\n")
+                    case b"HELO" | b"MAIL" | b"RCPT" | b"RSET" | b"NOOP":
+                        writer.write(b"250 OK\r\n")
+                    case b"DATA":
+                        writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                        await writer.drain()
+                        while (await reader.readline()) not in (b".\r\n", b""):
+                            pass
+                        writer.write(await self._accept())
+                    case b"QUIT":
+                        writer.write(b"221 Bye\r\n")
+                        await writer.drain()
+                        break
+                    case _:
+                        writer.write(b"502 Command not implemented\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # The client went away, or the sink is stopping.
+            pass
+        finally:
+            writer.close()
+
+    async def _accept(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self.failure_count += 1
+            return b"451 4.3.0 Injected failure\r\n"
+        self.message_count += 1
+        self.received_at.append(time.monotonic())
+        return b"250 OK\r\n"
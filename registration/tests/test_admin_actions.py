@@ -4,6 +4,7 @@ from django.core import mail
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from registration.models import RegistrationProfile
 
@@ -70,3 +71,25 @@ class AdminCustomActionsTestCase(TestCase):
 
         assert 1 == len(mail.outbox)
         assert mail.outbox[0].to == [self.user_info["email"]]
+
+    def test_activation_status_filter(self):
+        """
+        Test the admin list filter on the activation status
+        """
+        pending_profile = RegistrationProfile.objects.create_profile(
+            User.objects.create_user(**self.user_info)
+        )
+        expired_profile = RegistrationProfile.objects.create_profile(
+            User.objects.create_user(username="bob", password="secret"),
+            expires_at=timezone.now(),
+        )
+
+        registrationprofile_list = reverse(
+            "admin:registration_registrationprofile_changelist"
+        )
+        for status, profile in (
+            ("pending", pending_profile),
+            ("expired", expired_profile),
+        ):
+            response = self.client.get(registrationprofile_list, {"status": status})
+            assert list(response.context["cl"].result_list) == [profile]
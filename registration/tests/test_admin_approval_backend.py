@@ -1,11 +1,17 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import Site
 from django.core import mail
+from django.test.client import AsyncRequestFactory
 from django.test.utils import override_settings
 from django.urls import reverse
 
 from .test_default_backend import DefaultBackendViewTests
 
+from registration.backends.admin_approval.views import AsyncActivationView
+from registration.backends.admin_approval.views import AsyncApprovalView
+from registration.backends.admin_approval.views import AsyncResendActivationView
 from registration.backends.admin_approval.views import RegistrationView
 from registration.models import SupervisedRegistrationProfile
 
@@ -39,6 +45,10 @@ class AdminApprovalBackendViewTests(DefaultBackendViewTests):
 
     registration_view = RegistrationView
 
+    async_activation_view = AsyncActivationView
+
+    async_resend_activation_view = AsyncResendActivationView
+
     def test_approval(self):
         """
         Approval of an account functions properly.
@@ -78,6 +88,61 @@ class AdminApprovalBackendViewTests(DefaultBackendViewTests):
         assert profile.user.is_active
         self.assertRedirects(resp, reverse("registration_approve_complete"))
 
+    async def test_async_approval(self):
+        """
+        The asynchronous approval view activates the user once their
+        profile is activated.
+
+        """
+        site = Site(domain="example.com", name="example.com")
+        new_user = await self.registration_profile.objects.acreate_inactive_user(
+            site=site, username="bob", email="bob@example.com", password="secret"
+        )
+        profile = await self.registration_profile.objects.aget(user=new_user)
+        view = AsyncApprovalView.as_view()
+        request = AsyncRequestFactory().get("/")
+        request.user = await User.objects.acreate(
+            username="admin", is_staff=True, is_superuser=True
+        )
+
+        resp = await view(request, profile_id=profile.id)
+        assert resp.status_code == 200
+        assert resp.template_name == ["registration/admin_approve.html"]
+
+        await self.registration_profile.objects.aactivate_user(
+            profile.activation_key, site
+        )
+        resp = await view(request, profile_id=profile.id)
+        assert resp.status_code == 302
+        assert resp.url == reverse("registration_approve_complete")
+        await new_user.arefresh_from_db()
+        assert new_user.is_active
+
+    async def test_async_approval_permission(self):
+        """
+        The asynchronous approval view redirects anonymous users and users
+        who are not superusers to the login page, without approving.
+
+        """
+        site = Site(domain="example.com", name="example.com")
+        new_user = await self.registration_profile.objects.acreate_inactive_user(
+            site=site, username="bob", email="bob@example.com", password="secret"
+        )
+        profile = await self.registration_profile.objects.aget(user=new_user)
+        await self.registration_profile.objects.aactivate_user(
+            profile.activation_key, site
+        )
+        view = AsyncApprovalView.as_view()
+        staff_user = await User.objects.acreate(username="staff", is_staff=True)
+        for user in (AnonymousUser(), new_user, staff_user):
+            request = AsyncRequestFactory().get("/approve/")
+            request.user = user
+            resp = await view(request, profile_id=profile.id)
+            assert resp.status_code == 302
+            assert resp.url.startswith(settings.LOGIN_URL)
+        await new_user.arefresh_from_db()
+        assert not new_user.is_active
+
     @override_settings(
         REGISTRATION_ADMINS=[
             ("The admin", "admin_alpha@fakemail.com"),
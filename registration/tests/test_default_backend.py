@@ -5,14 +5,20 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.cache import caches
 from django.db import DatabaseError
 from django.test import TransactionTestCase
+from django.test.client import AsyncRequestFactory
 from django.test.client import RequestFactory
 from django.test.utils import override_settings
 from django.urls import reverse
 
+from registration.backends.default.views import AsyncActivationView
+from registration.backends.default.views import AsyncResendActivationView
 from registration.backends.default.views import RegistrationView
+from registration.cache import get_absorbed_activation_count
 from registration.forms import RegistrationForm
 from registration.models import RegistrationProfile
 
@@ -35,6 +41,10 @@ class DefaultBackendViewTests(TransactionTestCase):
 
     registration_view = RegistrationView
 
+    async_activation_view = AsyncActivationView
+
+    async_resend_activation_view = AsyncResendActivationView
+
     @override_settings(REGISTRATION_OPEN=True)
     def test_registration_open(self):
         """
@@ -144,6 +154,43 @@ class DefaultBackendViewTests(TransactionTestCase):
         assert 0 == len(mail.outbox)
         assert "bob@example.com" == request.session.get("registration_email")
 
+    def test_registration_activation_window(self):
+        """
+        Overridden Registration view can set the activation window of the
+        new user.
+
+        """
+
+        class RegistrationShortWindowView(self.registration_view):
+            def get_activation_window(self, user):
+                return datetime.timedelta(hours=1)
+
+        request_factory = RequestFactory()
+        view = RegistrationShortWindowView.as_view()
+        request = request_factory.post(
+            "/",
+            data={
+                "user-username": "bob",
+                "user-email": "bob@example.com",
+                "user-password1": "secret",
+                "user-password2": "secret",
+                "registration_short_window_view-current_step": "user",
+            },
+        )
+        request.user = AnonymousUser()
+
+        def dummy_get_response(request):  # pragma: no cover
+            return None
+
+        middleware = SessionMiddleware(dummy_get_response)
+        middleware.process_request(request)
+        view(request)
+
+        profile = self.registration_profile.objects.get(user__username="bob")
+        assert profile.expires_at == profile.user.date_joined + datetime.timedelta(
+            hours=1
+        )
+
     @override_settings(
         INSTALLED_APPS=(
             "django.contrib.auth",
@@ -263,6 +310,10 @@ class DefaultBackendViewTests(TransactionTestCase):
         user = profile.user
         user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
         user.save()
+        profile.expires_at = user.date_joined + datetime.timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS
+        )
+        profile.save()
 
         resp = self.client.get(
             reverse(
@@ -277,6 +328,71 @@ class DefaultBackendViewTests(TransactionTestCase):
         user = User.objects.get(username="bob")
         assert not user.is_active
 
+    async def test_async_activation(self):
+        """
+        The asynchronous activation view activates the account once, then
+        renders the failure template.
+
+        """
+        new_user = await self.registration_profile.objects.acreate_inactive_user(
+            site=Site(domain="example.com", name="example.com"),
+            username="bob",
+            email="bob@example.com",
+            password="secret",
+        )
+        profile = await self.registration_profile.objects.aget(user=new_user)
+        view = self.async_activation_view.as_view()
+        request = AsyncRequestFactory().get("/")
+
+        resp = await view(request, activation_key=profile.activation_key)
+        assert resp.status_code == 302
+        assert resp.url == reverse("registration_activation_complete")
+        await profile.arefresh_from_db()
+        assert profile.activated
+
+        resp = await view(request, activation_key="foo")
+        assert resp.status_code == 200
+        assert resp.template_name == ["registration/activate.html"]
+
+    @override_settings(REGISTRATION_CACHE="default")
+    def test_activation_outcome_cached(self):
+        """
+        Requesting an activation link again is answered from the cache.
+
+        """
+        caches["default"].clear()
+        self.client.post(
+            reverse("registration_register"),
+            data={
+                "user-username": "bob",
+                "user-email": "bob@example.com",
+                "user-password1": "secret",
+                "user-password2": "secret",
+                "registration_view-current_step": "user",
+            },
+        )
+        profile = self.registration_profile.objects.get(user__username="bob")
+        activation_url = reverse(
+            "registration_activate",
+            args=(),
+            kwargs={"activation_key": profile.activation_key},
+        )
+        invalid_url = reverse(
+            "registration_activate", args=(), kwargs={"activation_key": "foo"}
+        )
+
+        first = self.client.get(activation_url)
+        self.client.get(invalid_url)
+        # Mail scanners do not carry the session of the user.
+        self.client.cookies.clear()
+        with self.assertNumQueries(0):
+            second = self.client.get(activation_url)
+            resp = self.client.get(invalid_url)
+
+        self.assertRedirects(second, first.url, fetch_redirect_response=False)
+        self.assertTemplateUsed(resp, "registration/activate.html")
+        assert get_absorbed_activation_count() == 2
+
     def test_resend_activation(self):
         """
         Resend activation functions properly.
@@ -302,6 +418,75 @@ class DefaultBackendViewTests(TransactionTestCase):
         self.assertTemplateUsed(resp, "registration/resend_activation_complete.html")
         assert resp.context["email"] == profile.user.email
 
+    @override_settings(
+        REGISTRATION_CACHE="default",
+        REGISTRATION_RESEND_RATE=(1, 3600),
+        REGISTRATION_RESEND_COOLDOWN=0,
+    )
+    def test_resend_activation_rate_limited(self):
+        """
+        Resending activation emails is rate limited per client IP address
+        and per email address, with the same confirmation page.
+
+        """
+        caches["default"].clear()
+        for username in ("alice", "bob"):
+            self.registration_profile.objects.create_inactive_user(
+                site=Site.objects.get_current(),
+                send_email=False,
+                username=username,
+                email=f"{username}@example.com",
+                password="secret",
+            )
+
+        url = reverse("registration_resend_activation")
+        self.client.post(url, data={"email": "alice@example.com"})
+        resp = self.client.post(url, data={"email": "bob@example.com"})
+        self.assertTemplateUsed(resp, "registration/resend_activation_complete.html")
+        assert [message.to for message in mail.outbox] == [["alice@example.com"]]
+
+        resp = self.client.post(
+            url, data={"email": "alice@example.com"}, REMOTE_ADDR="10.0.0.1"
+        )
+        self.assertTemplateUsed(resp, "registration/resend_activation_complete.html")
+        assert len(mail.outbox) == 1
+
+        self.client.post(url, data={"email": "bob@example.com"}, REMOTE_ADDR="10.0.0.2")
+        assert len(mail.outbox) == 2
+
+    @override_settings(
+        REGISTRATION_CACHE="default",
+        REGISTRATION_RESEND_RATE=(1, 3600),
+        REGISTRATION_RESEND_COOLDOWN=0,
+    )
+    def test_resend_activation_rate_limited_email_first(self):
+        """
+        A resend refused for its email address does not use up the token of
+        the client IP address.
+
+        """
+        caches["default"].clear()
+        for username in ("alice", "bob"):
+            self.registration_profile.objects.create_inactive_user(
+                site=Site.objects.get_current(),
+                send_email=False,
+                username=username,
+                email=f"{username}@example.com",
+                password="secret",
+            )
+
+        url = reverse("registration_resend_activation")
+        self.client.post(url, data={"email": "alice@example.com"})
+        self.client.post(
+            url, data={"email": "alice@example.com"}, REMOTE_ADDR="10.0.0.1"
+        )
+        assert len(mail.outbox) == 1
+        self.client.post(url, data={"email": "bob@example.com"}, REMOTE_ADDR="10.0.0.1")
+        assert [message.to for message in mail.outbox] == [
+            ["alice@example.com"],
+            ["bob@example.com"],
+        ]
+
     def test_resend_activation_invalid_email(self):
         """
         Calling resend with an invalid email shows the same template.
@@ -312,3 +497,56 @@ class DefaultBackendViewTests(TransactionTestCase):
             data={"email": "invalid@example.com"},
         )
         self.assertTemplateUsed(resp, "registration/resend_activation_complete.html")
+
+    async def test_async_resend_activation(self):
+        """
+        The asynchronous resend activation view sends the activation email
+        again.
+
+        """
+        await self.registration_profile.objects.acreate_inactive_user(
+            site=Site(domain="example.com", name="example.com"),
+            send_email=False,
+            username="bob",
+            email="bob@example.com",
+            password="secret",
+        )
+        view = self.async_resend_activation_view.as_view()
+        request = AsyncRequestFactory().post("/", data={"email": "bob@example.com"})
+        request.user = AnonymousUser()
+
+        resp = await view(request)
+        assert resp.status_code == 200
+        assert b"bob@example.com" in resp.content
+        assert len(mail.outbox) == 1
+
+    @override_settings(
+        REGISTRATION_CACHE="default",
+        REGISTRATION_RESEND_RATE=(1, 3600),
+        REGISTRATION_RESEND_COOLDOWN=0,
+    )
+    async def test_async_resend_activation_rate_limited(self):
+        """
+        The asynchronous resend activation view applies the rate limits with
+        the asynchronous cache API.
+
+        """
+        await caches["default"].aclear()
+        await self.registration_profile.objects.acreate_inactive_user(
+            site=Site(domain="example.com", name="example.com"),
+            send_email=False,
+            username="bob",
+            email="bob@example.com",
+            password="secret",
+        )
+        view = self.async_resend_activation_view.as_view()
+        for _ in range(2):
+            request = AsyncRequestFactory().post("/", data={"email": "bob@example.com"})
+            request.user = AnonymousUser()
+            with patch(
+                "registration.views.allow_resend_activation",
+                side_effect=AssertionError,
+            ):
+                resp = await view(request)
+            assert resp.status_code == 200
+        assert len(mail.outbox) == 1
@@ -1,24 +1,55 @@
+import csv
 import datetime
+import gzip
 import hashlib
+import json
+import os
 import re
+import shutil
+import smtplib
+import tempfile
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.core import management
+from django.core.cache import caches
 from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
 from django.test import TransactionTestCase
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 
 import pytest
-
+from asgiref.sync import sync_to_async
+
+from registration import signals
+from registration.archive import RegistrationArchive
+from registration.archive import get_archive_fields
+from registration.dispatch import NOTIFICATION_LANE
+from registration.dispatch import get_email_dispatcher
+from registration.dispatch import send_messages
+from registration.dispatch import use_email_connection
+from registration.management.commands import cleanupregistration
+from registration.management.commands.cleanupregistration import split_range
+from registration.management.commands.sendapprovaldigest import get_site
+from registration.models import OutboxEmail
 from registration.models import RegistrationProfile
 from registration.models import SupervisedRegistrationProfile
+from registration.smtp_sink import SMTPSink
 
 Site = apps.get_model("sites", "Site")
 
@@ -42,10 +73,27 @@ class RegistrationModelTests(TransactionTestCase):
     }
 
     registration_profile = RegistrationProfile
+    # Emails sent when a profile is activated.
+    activation_emails_count = 0
+    # SELECT, then both UPDATE statements wrapped in BEGIN/COMMIT.
+    activation_query_count = 5
+    # SELECT, then UPDATE of the activation key.
+    resend_query_count = 2
 
     def setUp(self):
         warnings.simplefilter("always", UserWarning)
 
+    def sync_expiration_date(self, user):
+        """
+        Recompute the expiration date of the activation key of ``user``
+        after its ``date_joined`` was changed.
+
+        """
+        self.registration_profile.objects.filter(user=user).update(
+            expires_at=user.date_joined
+            + timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        )
+
     def test_profile_creation(self):
         """
         Creating a registration profile for a user populates the
@@ -89,6 +137,29 @@ class RegistrationModelTests(TransactionTestCase):
         assert len(mail.outbox) == 1
         assert mail.outbox[0].to == [self.user_info["email"]]
 
+    def test_activation_email_templates_cached(self):
+        """
+        The email templates are looked up once, including the missing HTML
+        body template, until the settings change.
+
+        """
+        User = get_user_model()
+        new_user = User.objects.create_user(**self.user_info)
+        profile = self.registration_profile.objects.create_profile(new_user)
+        site = Site.objects.get_current()
+        with override_settings(ACTIVATION_EMAIL_HTML="registration/missing.html"):
+            profile.send_activation_email(site)
+            with mock.patch(
+                "registration.email_templates.get_template"
+            ) as get_template:
+                profile.send_activation_email(site)
+            get_template.assert_not_called()
+        assert not mail.outbox[0].alternatives
+        assert not mail.outbox[1].alternatives
+
+        profile.send_activation_email(site)
+        assert mail.outbox[2].alternatives
+
     def test_activation_email_uses_registration_default_from_email(self):
         """
         ``RegistrationProfile.send_activation_email`` sends an
@@ -280,6 +351,7 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         new_user.save()
+        self.sync_expiration_date(new_user)
         profile = self.registration_profile.objects.get(user=new_user)
         self.registration_profile.objects.activate_user(
             profile.activation_key, Site.objects.get_current()
@@ -300,9 +372,140 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         new_user.save()
+        self.sync_expiration_date(new_user)
         profile = self.registration_profile.objects.get(user=new_user)
         assert profile.activation_key_expired()
 
+    def test_profile_expiration_date(self):
+        """
+        Creating a profile stores the expiration date of its activation
+        key, ``ACCOUNT_ACTIVATION_DAYS`` after the user joined.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        assert profile.expires_at == new_user.date_joined + timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS
+        )
+
+    def test_user_creation_activation_window(self):
+        """
+        ``create_inactive_user`` accepts an activation window replacing
+        ``ACCOUNT_ACTIVATION_DAYS`` for this user.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            activation_window=timedelta(hours=12),
+            **self.user_info,
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        assert profile.expires_at == new_user.date_joined + timedelta(hours=12)
+        assert not profile.activation_key_expired()
+        assert "within the next\n1 days" in mail.outbox[0].body
+
+        self.registration_profile.objects.filter(pk=profile.pk).update(
+            expires_at=timezone.now()
+        )
+        _, activated = self.registration_profile.objects.activate_user(
+            profile.activation_key, Site.objects.get_current()
+        )
+        assert not activated
+
+    def test_pending_and_expired_profiles(self):
+        """
+        ``pending()`` and ``expired()`` select the profiles which can still
+        be activated and the ones whose activation key expired.
+
+        """
+        pending_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        expired_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            username="bob",
+            password="secret",
+            email="bob@example.com",
+        )
+        expired_user.date_joined -= datetime.timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS + 1
+        )
+        expired_user.save()
+        self.sync_expiration_date(expired_user)
+        legacy_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            username="carol",
+            password="secret",
+            email="carol@example.com",
+        )
+        legacy_user.date_joined -= datetime.timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS + 1
+        )
+        legacy_user.save()
+        self.registration_profile.objects.filter(user=legacy_user).update(
+            expires_at=None
+        )
+
+        # Until it has an expiration date, the legacy profile is in neither.
+        pending = self.registration_profile.objects.pending()
+        assert [profile.user for profile in pending] == [pending_user]
+        expired = self.registration_profile.objects.expired()
+        assert [profile.user for profile in expired] == [expired_user]
+
+        assert self.registration_profile.objects.backfill_expires_at(batch_size=1) == 1
+        legacy_user.refresh_from_db()
+        assert self.registration_profile.objects.get(
+            user=legacy_user
+        ).expires_at == legacy_user.date_joined + timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS
+        )
+        pending = self.registration_profile.objects.pending()
+        assert [profile.user for profile in pending] == [pending_user]
+        expired = self.registration_profile.objects.expired().order_by("pk")
+        assert [profile.user for profile in expired] == [expired_user, legacy_user]
+        assert all(profile.activation_key_expired() for profile in expired)
+
+    def test_profile_save_sets_expires_at(self):
+        """
+        Saving a profile without an expiration date sets it to the date its
+        user joined plus ``ACCOUNT_ACTIVATION_DAYS``.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        self.registration_profile.objects.update(expires_at=None)
+        profile = self.registration_profile.objects.get(user=new_user)
+        profile.activation_key = "a" * 64
+        profile.save(update_fields=["activation_key"])
+
+        profile.refresh_from_db()
+        assert profile.expires_at == new_user.date_joined + timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS
+        )
+
+    def test_backfill_expires_at_migration(self):
+        """
+        The ``0009_backfill_expires_at`` migration computes the expiration
+        date of the profiles which lack one.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        self.registration_profile.objects.update(expires_at=None)
+
+        migration = import_module("registration.migrations.0009_backfill_expires_at")
+        with connection.schema_editor() as schema_editor:
+            migration.backfill_expires_at(apps, schema_editor)
+
+        profile = self.registration_profile.objects.get(user=new_user)
+        assert profile.expires_at == new_user.date_joined + timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS
+        )
+
     def test_valid_activation(self):
         """
         Activating a user within the permitted window makes the
@@ -362,6 +565,7 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         new_user.save()
+        self.sync_expiration_date(new_user)
 
         profile = self.registration_profile.objects.get(user=new_user)
         user, activated = self.registration_profile.objects.activate_user(
@@ -378,6 +582,78 @@ class RegistrationModelTests(TransactionTestCase):
         profile = self.registration_profile.objects.get(user=new_user)
         assert not profile.activated
 
+    def test_concurrent_activation(self):
+        """
+        When two requests activate the same profile concurrently, only
+        one of them reports the activation.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        first = self.registration_profile.objects.get(user=new_user)
+        second = self.registration_profile.objects.get(user=new_user)
+
+        assert self.registration_profile.objects._activate(
+            first, Site.objects.get_current(), get_profile=False
+        )
+        assert not self.registration_profile.objects._activate(
+            second, Site.objects.get_current(), get_profile=False
+        )
+        assert len(mail.outbox) == self.activation_emails_count
+
+    def test_activation_query_count(self):
+        """
+        Activating a user reads the profile and its user at once, then
+        flips the activation flags with conditional updates.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        site = Site.objects.get_current()
+        with self.assertNumQueries(self.activation_query_count):
+            _, activated = self.registration_profile.objects.activate_user(
+                profile.activation_key, site
+            )
+        assert activated
+
+    async def test_async_activation(self):
+        """
+        ``acreate_inactive_user`` and ``aactivate_user`` behave as their
+        synchronous versions.
+
+        """
+        site = await sync_to_async(Site.objects.get_current)()
+        new_user = await self.registration_profile.objects.acreate_inactive_user(
+            site=site, **self.user_info
+        )
+        assert not new_user.is_active
+        assert len(mail.outbox) == 1
+
+        profile = await self.registration_profile.objects.aget(user=new_user)
+        user, activated = await self.registration_profile.objects.aactivate_user(
+            profile.activation_key, site
+        )
+        assert activated
+        assert user.pk == new_user.pk
+        User = get_user_model()
+        assert (
+            user.is_active
+            == await User.objects.filter(pk=user.pk, is_active=True).aexists()
+        )
+        assert len(mail.outbox) == 1 + self.activation_emails_count
+
+        _, activated = await self.registration_profile.objects.aactivate_user(
+            profile.activation_key, site
+        )
+        assert not activated
+        assert await self.registration_profile.objects.aactivate_user("foo", site) == (
+            False,
+            False,
+        )
+
     def test_activation_invalid_key(self):
         """
         Attempting to activate with a key which is not a SHA256 hash
@@ -446,6 +722,162 @@ class RegistrationModelTests(TransactionTestCase):
         )
         self.assertFalse(activated)
 
+    @override_settings(REGISTRATION_SIGNED_ACTIVATION_KEYS=True)
+    def test_signed_activation_key(self):
+        """
+        With ``REGISTRATION_SIGNED_ACTIVATION_KEYS``, the activation email
+        holds a signed key which activates the account.
+
+        """
+        # Signed keys hold the second at which they were issued.
+        with mock.patch("django.core.signing.time.time", return_value=1e9):
+            new_user = self.registration_profile.objects.create_inactive_user(
+                site=Site.objects.get_current(), **self.user_info
+            )
+            profile = self.registration_profile.objects.get(user=new_user)
+            activation_key = profile.get_activation_key()
+        assert activation_key != profile.activation_key
+        assert activation_key in mail.outbox[0].body
+
+        user, activated = self.registration_profile.objects.activate_user(
+            activation_key, Site.objects.get_current()
+        )
+        assert activated
+        assert user.id == new_user.id
+
+    @override_settings(REGISTRATION_SIGNED_ACTIVATION_KEYS=True)
+    def test_signed_activation_key_invalid(self):
+        """
+        Keys which are not properly signed, or whose signature has expired,
+        are rejected without querying the database.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        activation_key = profile.get_activation_key()
+        last_char = "A" if activation_key[-1] != "A" else "B"
+        tampered_key = f"{activation_key[:-1]}{last_char}"
+        site = Site.objects.get_current()
+
+        for invalid_key in ("foo", profile.activation_key, tampered_key):
+            with self.assertNumQueries(0):
+                result = self.registration_profile.objects.activate_user(
+                    invalid_key, site
+                )
+            assert result == (False, False)
+
+        later = profile.expires_at + timedelta(seconds=1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            with self.assertNumQueries(0):
+                result = self.registration_profile.objects.activate_user(
+                    activation_key, site
+                )
+        assert result == (False, False)
+
+    @override_settings(REGISTRATION_SIGNED_ACTIVATION_KEYS=True)
+    def test_signed_activation_key_activation_window(self):
+        """
+        Signed keys stay valid for the whole activation window of the
+        profile, even when it is longer than ``ACCOUNT_ACTIVATION_DAYS``.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            send_email=False,
+            activation_window=timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS * 2),
+            **self.user_info,
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        activation_key = profile.get_activation_key()
+
+        later = timezone.now() + timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            user, activated = self.registration_profile.objects.activate_user(
+                activation_key, Site.objects.get_current()
+            )
+        assert activated
+        assert user.id == new_user.id
+
+    @override_settings(REGISTRATION_SIGNED_ACTIVATION_KEYS=True)
+    def test_signed_activation_key_resend(self):
+        """
+        Resending the activation email invalidates the signed keys sent
+        before.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        activation_key = profile.get_activation_key()
+        assert self.registration_profile.objects.resend_activation_mail(
+            email=self.user_info["email"], site=Site.objects.get_current()
+        )
+
+        _, activated = self.registration_profile.objects.activate_user(
+            activation_key, Site.objects.get_current()
+        )
+        assert not activated
+
+    @override_settings(REGISTRATION_CACHE="default")
+    def test_activation_unknown_key_cached(self):
+        """
+        Once a key failed to match a profile, retrying it is answered from
+        the registration cache.
+
+        """
+        caches["default"].clear()
+        invalid_key = hashlib.sha256("foo".encode("latin-1")).hexdigest()
+        site = Site.objects.get_current()
+        with self.assertNumQueries(1):
+            self.registration_profile.objects.activate_user(invalid_key, site)
+        with self.assertNumQueries(0):
+            result = self.registration_profile.objects.activate_user(invalid_key, site)
+        assert result == (False, False)
+
+    @override_settings(REGISTRATION_CACHE="default")
+    async def test_async_activation_unknown_key_cached(self):
+        """
+        ``aactivate_user`` remembers unknown keys with the asynchronous
+        cache API.
+
+        """
+        await caches["default"].aclear()
+        invalid_key = hashlib.sha256("foo".encode("latin-1")).hexdigest()
+        site = Site(domain="example.com", name="example.com")
+        with mock.patch(
+            "registration.models.remember_unknown_activation_key",
+            side_effect=AssertionError,
+        ):
+            await self.registration_profile.objects.aactivate_user(invalid_key, site)
+        with mock.patch(
+            "registration.models.is_unknown_activation_key",
+            side_effect=AssertionError,
+        ), mock.patch.object(
+            self.registration_profile.objects, "with_user", side_effect=AssertionError
+        ):
+            result = await self.registration_profile.objects.aactivate_user(
+                invalid_key, site
+            )
+        assert result == (False, False)
+
+    @override_settings(
+        REGISTRATION_CACHE="default", REGISTRATION_NEGATIVE_CACHE_TIMEOUT=0
+    )
+    def test_activation_unknown_key_cache_timeout(self):
+        """
+        Unknown keys are looked up again once their cache entry expired.
+
+        """
+        caches["default"].clear()
+        invalid_key = hashlib.sha256("foo".encode("latin-1")).hexdigest()
+        site = Site.objects.get_current()
+        self.registration_profile.objects.activate_user(invalid_key, site)
+        with self.assertNumQueries(1):
+            self.registration_profile.objects.activate_user(invalid_key, site)
+
     def test_expired_user_deletion_activation_window(self):
         """
         ``RegistrationProfile.objects.delete_expired_users()`` only
@@ -465,6 +897,7 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         expired_user.save()
+        self.sync_expiration_date(expired_user)
 
         deleted_count = self.registration_profile.objects.delete_expired_users()
         assert deleted_count == 1
@@ -472,6 +905,94 @@ class RegistrationModelTests(TransactionTestCase):
         User = get_user_model()
         self.assertRaises(User.DoesNotExist, User.objects.get, username="bob")
 
+    def test_expired_user_deletion_batches(self):
+        """
+        ``delete_expired_users`` deletes the expired users in batches of
+        ``batch_size``, each in its own transaction.
+
+        """
+        site = Site.objects.get_current()
+        for username in ("alice", "bob", "carol"):
+            self.registration_profile.objects.create_inactive_user(
+                site=site,
+                activation_window=datetime.timedelta(0),
+                username=username,
+                password="secret",
+                email=f"{username}@example.com",
+            )
+        self.registration_profile.objects.create_inactive_user(
+            site=site, username="dave", password="secret", email="dave@example.com"
+        )
+
+        with mock.patch.object(
+            type(self.registration_profile.objects),
+            "delete_expired_batch",
+            autospec=True,
+            side_effect=type(self.registration_profile.objects).delete_expired_batch,
+        ) as delete_expired_batch:
+            deleted_count = self.registration_profile.objects.delete_expired_users(
+                batch_size=2
+            )
+        assert deleted_count == 3
+        assert [len(call.args[1]) for call in delete_expired_batch.mock_calls] == [
+            2,
+            1,
+        ]
+        assert self.registration_profile.objects.get().user.username == "dave"
+        assert get_user_model().objects.get().username == "dave"
+
+    def test_expired_user_deletion_logging(self):
+        """
+        ``delete_expired_users`` logs a summary of each batch, and a sample
+        of the deleted profiles at the DEBUG level.
+
+        """
+        self.create_expired_users(3)
+        with self.assertLogs("registration.models", "DEBUG") as logs:
+            self.registration_profile.objects.delete_expired_users(batch_size=2)
+        assert [record.levelname for record in logs.records] == ["INFO", "INFO"]
+        assert (
+            logs.records[0]
+            .getMessage()
+            .startswith("Deleted 2 expired registration profiles")
+        )
+
+        self.create_expired_users(3)
+        with override_settings(REGISTRATION_CLEANUP_LOG_SAMPLE_RATE=1):
+            with self.assertLogs("registration.models", "DEBUG") as logs:
+                self.registration_profile.objects.delete_expired_users(batch_size=2)
+        assert [record.levelname for record in logs.records] == [
+            "DEBUG",
+            "DEBUG",
+            "INFO",
+            "DEBUG",
+            "INFO",
+        ]
+
+    async def test_async_expired_user_deletion(self):
+        """
+        ``adelete_expired_users`` deletes the inactive users whose activation
+        window has expired.
+
+        """
+        site = await sync_to_async(Site.objects.get_current)()
+        await self.registration_profile.objects.acreate_inactive_user(
+            site=site, **self.user_info
+        )
+        await self.registration_profile.objects.acreate_inactive_user(
+            site=site,
+            activation_window=datetime.timedelta(0),
+            username="bob",
+            password="secret",
+            email="bob@example.com",
+        )
+
+        deleted_count = await self.registration_profile.objects.adelete_expired_users()
+        assert deleted_count == 1
+        assert await self.registration_profile.objects.acount() == 1
+        User = get_user_model()
+        assert not await User.objects.filter(username="bob").aexists()
+
     def test_expired_user_deletion_ignore_activated(self):
         """
         ``RegistrationProfile.objects.delete_expired_users()`` only
@@ -495,6 +1016,7 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         user.save()
+        self.sync_expiration_date(user)
 
         deleted_count = self.registration_profile.objects.delete_expired_users()
         assert deleted_count == 0
@@ -502,6 +1024,38 @@ class RegistrationModelTests(TransactionTestCase):
         User = get_user_model()
         assert User.objects.get(username="bob") == user
 
+    def test_expired_user_deletion_activated_during_batch(self):
+        """
+        A profile activated after its batch was selected is not deleted, nor
+        its user.
+
+        """
+        self.create_expired_users(1)
+        manager = self.registration_profile.objects
+        batch = manager.expired_batch(10)
+        profile = manager.get()
+        manager.filter(pk=profile.pk).update(activated=True)
+
+        assert manager.delete_expired_batch(batch) == 0
+        assert manager.get() == profile
+        assert get_user_model().objects.get() == profile.user
+
+    def test_expired_user_deletion_user_activated_during_batch(self):
+        """
+        A profile whose user was activated after its batch was selected is
+        not deleted, nor its user, nor counted as deleted.
+
+        """
+        self.create_expired_users(2)
+        manager = self.registration_profile.objects
+        batch = manager.expired_batch(10)
+        profile = manager.get(user__username="expired0")
+        get_user_model().objects.filter(pk=profile.user_id).update(is_active=True)
+
+        assert manager.delete_expired_batch(batch) == 1
+        assert manager.get() == profile
+        assert get_user_model().objects.get() == profile.user
+
     def test_expired_user_deletion_missing_user(self):
         """
         ``RegistrationProfile.objects.delete_expired_users()`` only deletes
@@ -522,6 +1076,7 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         expired_user.save()
+        self.sync_expiration_date(expired_user)
         User = get_user_model()
         # Ensure that we cleanup the expired profile even if the user does not
         # exist. We simulate this with raw SQL, calling `expired_user.delete()`
@@ -550,6 +1105,7 @@ class RegistrationModelTests(TransactionTestCase):
         )
         active_user.is_active = True
         active_user.save()
+        self.sync_expiration_date(active_user)
 
         deleted_count = self.registration_profile.objects.delete_expired_users()
         assert deleted_count == 0
@@ -576,49 +1132,571 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         expired_user.save()
+        self.sync_expiration_date(expired_user)
 
         management.call_command("cleanupregistration")
         assert self.registration_profile.objects.count() == 1
         User = get_user_model()
         self.assertRaises(User.DoesNotExist, User.objects.get, username="bob")
 
-    def test_resend_activation_email(self):
+    def create_expired_users(self, count):
+        for i in range(count):
+            self.registration_profile.objects.create_inactive_user(
+                site=Site.objects.get_current(),
+                activation_window=datetime.timedelta(0),
+                username=f"expired{i}",
+                password="secret",
+                email=f"expired{i}@example.com",
+            )
+
+    def test_management_command_batches(self):
         """
-        Test resending activation email to an existing user
+        ``cleanupregistration --batch-size`` reports each batch deleted.
+
         """
-        user = self.registration_profile.objects.create_inactive_user(
-            site=Site.objects.get_current(), send_email=False, **self.user_info
-        )
-        assert len(mail.outbox) == 0
+        self.create_expired_users(3)
+        out = StringIO()
+        management.call_command("cleanupregistration", batch_size=2, stdout=out)
+        output = out.getvalue()
+        assert "Deleted batch user count=2, total=2" in output
+        assert "Deleted batch user count=1, total=3" in output
+        assert "Deleted user count=3" in output
+        assert not self.registration_profile.objects.exists()
 
-        profile = self.registration_profile.objects.get(user=user)
-        orig_activation_key = profile.activation_key
+    def test_management_command_max_runtime(self):
+        """
+        ``cleanupregistration --max-runtime`` stops after the running batch,
+        and the next run resumes the deletion.
 
-        assert self.registration_profile.objects.resend_activation_mail(
-            email=self.user_info["email"],
-            site=Site.objects.get_current(),
+        """
+        self.create_expired_users(3)
+        out = StringIO()
+        management.call_command(
+            "cleanupregistration", batch_size=2, max_runtime=0, stdout=out
         )
+        assert "stopped at --max-runtime. Deleted user count=2" in out.getvalue()
+        assert self.registration_profile.objects.count() == 1
 
-        profile = self.registration_profile.objects.get(pk=profile.pk)
-        new_activation_key = profile.activation_key
-
-        assert orig_activation_key != new_activation_key
-        assert len(mail.outbox) == 1
+        management.call_command("cleanupregistration", batch_size=2, stdout=out)
+        assert not self.registration_profile.objects.exists()
 
-    def test_resend_activation_email_nonexistent_user(self):
+    def test_management_command_dry_run(self):
         """
-        Test resending activation email to a nonexisting user
+        ``cleanupregistration --dry-run`` counts the expired users in a
+        single query and deletes nothing.
+
         """
-        assert not self.registration_profile.objects.resend_activation_mail(
-            email=self.user_info["email"],
-            site=Site.objects.get_current(),
+        self.create_expired_users(3)
+        # Profiles lacking an expiration date are counted as the cleanup
+        # would date them, though the dry run does not backfill them.
+        get_user_model().objects.filter(username__in=["expired0", "expired1"]).update(
+            date_joined=timezone.now()
+            - datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
         )
+        self.registration_profile.objects.filter(
+            user__username__in=["expired0", "expired1"]
+        ).update(expires_at=None)
+        self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        self.registration_profile.objects.filter(user__username="alice").update(
+            expires_at=None
+        )
+        out = StringIO()
+        with self.assertNumQueries(1):
+            management.call_command("cleanupregistration", dry_run=True, stdout=out)
+        assert "Expired user count=3" in out.getvalue()
+        assert self.registration_profile.objects.count() == 4
+        assert self.registration_profile.objects.filter(expires_at=None).count() == 3
 
-        assert len(mail.outbox) == 0
+    def test_management_command_json(self):
+        """
+        ``cleanupregistration --json`` writes a JSON summary of the run.
 
-    def test_resend_activation_email_activated_user(self):
         """
-        Test the scenario where user tries to resend activation code
+        self.create_expired_users(3)
+        out = StringIO()
+        management.call_command(
+            "cleanupregistration", batch_size=2, json=True, stdout=out
+        )
+        summary = json.loads(out.getvalue())
+        assert summary["deleted_count"] == 3
+        assert summary["batch_count"] == 2
+        assert summary["stopped"] is False
+        assert summary["database"] == "default"
+
+    def get_archive_path(self, name):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return os.path.join(directory, name)
+
+    def test_management_command_archive(self):
+        """
+        ``cleanupregistration --archive`` writes the deleted users to a
+        compressed JSON Lines archive, and resumes it after an interrupted
+        batch.
+
+        """
+        path = self.get_archive_path("registrations.jsonl.gz")
+        self.create_expired_users(3)
+        management.call_command(
+            "cleanupregistration", batch_size=2, archive=path, stdout=StringIO()
+        )
+        # A batch interrupted while it was written.
+        with open(path, "ab") as archive:
+            archive.write(b"\x1f\x8b")
+        self.create_expired_users(1)
+        with mock.patch(
+            "registration.archive.RegistrationArchive.write", side_effect=OSError
+        ):
+            with pytest.raises(OSError):
+                management.call_command(
+                    "cleanupregistration", archive=path, stdout=StringIO()
+                )
+        assert self.registration_profile.objects.count() == 1
+        management.call_command("cleanupregistration", archive=path, stdout=StringIO())
+        assert not self.registration_profile.objects.exists()
+
+        with gzip.open(path, "rt") as archive:
+            records = [json.loads(line) for line in archive]
+        assert [record["user__username"] for record in records] == [
+            "expired0",
+            "expired1",
+            "expired2",
+            "expired0",
+        ]
+        assert "user__password" not in records[0]
+        assert records[0]["activated"] is False
+
+    def test_archive_open_error(self):
+        """
+        The archive is closed when it fails to be cut back to its recorded
+        length.
+
+        """
+        path = self.get_archive_path("registrations.jsonl")
+        with open(f"{path}.offset", "w") as offset_file:
+            offset_file.write("corrupted")
+        archive = RegistrationArchive(path, get_archive_fields())
+        with pytest.raises(ValueError):
+            archive.open()
+        assert archive._file.closed
+
+    def test_management_command_archive_rotated(self):
+        """
+        An archive rotated away is started again from its beginning, with
+        the header of a CSV archive.
+
+        """
+        path = self.get_archive_path("registrations.csv")
+        self.create_expired_users(1)
+        management.call_command("cleanupregistration", archive=path, stdout=StringIO())
+        os.rename(path, f"{path}.1")
+        self.create_expired_users(1)
+        management.call_command("cleanupregistration", archive=path, stdout=StringIO())
+
+        with open(path, newline="") as archive:
+            content = archive.read()
+        assert not content.startswith("\0")
+        records = list(csv.DictReader(StringIO(content)))
+        assert [record["user__username"] for record in records] == ["expired0"]
+        with open(f"{path}.offset") as offset_file:
+            assert int(offset_file.read()) == os.path.getsize(path)
+
+    def test_management_command_archive_csv(self):
+        """
+        ``cleanupregistration --archive`` writes a CSV archive when its path
+        ends with ``.csv``.
+
+        """
+        path = self.get_archive_path("registrations.csv")
+        self.create_expired_users(3)
+        management.call_command(
+            "cleanupregistration", batch_size=2, archive=path, stdout=StringIO()
+        )
+        with open(path, newline="") as archive:
+            records = list(csv.DictReader(archive))
+        assert [record["user__email"] for record in records] == [
+            "expired0@example.com",
+            "expired1@example.com",
+            "expired2@example.com",
+        ]
+
+    def test_activation_key_is_unique(self):
+        """
+        Two profiles can not share the same activation key.
+
+        """
+        User = get_user_model()
+        profile = self.registration_profile.objects.create_profile(
+            User.objects.create_user(**self.user_info)
+        )
+        bob = User.objects.create_user(
+            username="bob", password="secret", email="bob@example.com"
+        )
+        with self.assertRaises(IntegrityError):
+            self.registration_profile.objects.create_profile(
+                bob, activation_key=profile.activation_key
+            )
+
+    def test_activation_key_unique_migration_postgresql(self):
+        """
+        On PostgreSQL, the ``0007_activation_key_unique`` migration drops the
+        invalid index of a failed build, builds the index concurrently and
+        makes it the unique constraint of the migration state.
+
+        """
+        migration = import_module("registration.migrations.0007_activation_key_unique")
+        schema_editor = mock.MagicMock()
+        schema_editor.connection.vendor = "postgresql"
+        schema_editor.quote_name = lambda name: f'"{name}"'
+        schema_editor._create_index_name.return_value = "activation_key_uniq"
+        cursor = schema_editor.connection.cursor.return_value.__enter__.return_value
+        table = '"registration_registrationprofile"'
+
+        for state, statements in [
+            (
+                (False, False),
+                [
+                    'DROP INDEX CONCURRENTLY "activation_key_uniq"',
+                    'CREATE UNIQUE INDEX CONCURRENTLY "activation_key_uniq" '
+                    f'ON {table} ("activation_key")',
+                    f'ALTER TABLE {table} ADD CONSTRAINT "activation_key_uniq" '
+                    'UNIQUE USING INDEX "activation_key_uniq"',
+                ],
+            ),
+            (
+                (True, False),
+                [
+                    f'ALTER TABLE {table} ADD CONSTRAINT "activation_key_uniq" '
+                    'UNIQUE USING INDEX "activation_key_uniq"'
+                ],
+            ),
+            ((True, True), []),
+        ]:
+            cursor.fetchone.return_value = state
+            schema_editor.execute.reset_mock()
+            migration.create_activation_key_index(apps, schema_editor)
+            assert [
+                call.args[0] for call in schema_editor.execute.mock_calls
+            ] == statements
+
+        schema_editor.execute.reset_mock()
+        migration.drop_activation_key_index(apps, schema_editor)
+        schema_editor.execute.assert_called_once_with(
+            f'ALTER TABLE {table} DROP CONSTRAINT "activation_key_uniq"'
+        )
+
+    def test_repair_activation_keys_command(self):
+        """
+        The ``repairactivationkeys`` management command gives every profile
+        but one a new key when several profiles share an activation key.
+
+        """
+        migration = import_module("registration.migrations.0007_activation_key_unique")
+        with connection.schema_editor() as schema_editor:
+            migration.drop_activation_key_index(apps, schema_editor)
+        try:
+            User = get_user_model()
+            for username in ("alice", "bob", "carol"):
+                self.registration_profile.objects.create_profile(
+                    User.objects.create_user(username=username, password="secret"),
+                    activation_key="ALREADY_ACTIVATED",
+                )
+            self.registration_profile.objects.create_profile(
+                User.objects.create_user(username="dave", password="secret")
+            )
+
+            out = StringIO()
+            management.call_command("repairactivationkeys", dry_run=True, stdout=out)
+            assert "shared by 3 profiles" in out.getvalue()
+            keys = RegistrationProfile.objects.values_list("activation_key")
+            assert keys.filter(activation_key="ALREADY_ACTIVATED").count() == 3
+
+            out = StringIO()
+            management.call_command("repairactivationkeys", batch_size=1, stdout=out)
+            assert "Repaired profile count=2" in out.getvalue()
+            assert keys.filter(activation_key="ALREADY_ACTIVATED").count() == 1
+            assert keys.distinct().count() == 4
+        finally:
+            RegistrationProfile.objects.all().delete()
+            with connection.schema_editor() as schema_editor:
+                migration.create_activation_key_index(apps, schema_editor)
+
+    @override_settings(REGISTRATION_ACTIVATION_KEY_STORAGE="base64")
+    def test_base64_activation_key_storage(self):
+        """
+        With ``REGISTRATION_ACTIVATION_KEY_STORAGE = "base64"`` activation keys
+        are stored in 43 characters, and activation links keep the
+        hexadecimal form.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        assert len(profile.activation_key) == 43
+        activation_key = profile.get_activation_key()
+        assert re.match("^[a-f0-9]{64}$", activation_key)
+        assert activation_key in mail.outbox[0].body
+
+        user, activated = self.registration_profile.objects.activate_user(
+            activation_key, Site.objects.get_current()
+        )
+        assert activated
+        assert user.pk == new_user.pk
+
+    def test_convert_activation_keys_command(self):
+        """
+        The ``convertactivationkeys`` management command converts the stored
+        activation keys, and activation accepts the hexadecimal form during
+        and after the conversion.
+
+        """
+        User = get_user_model()
+        profiles = []
+        for username in ("alice", "bob", "carol"):
+            profiles.append(
+                self.registration_profile.objects.create_profile(
+                    User.objects.create_user(username=username, password="secret")
+                )
+            )
+        hex_keys = [profile.activation_key for profile in profiles]
+
+        out = StringIO()
+        management.call_command(
+            "convertactivationkeys", to="base64", batch_size=2, stdout=out
+        )
+        assert "Converted profile count=3" in out.getvalue()
+        for profile, activation_key in zip(profiles, hex_keys):
+            profile.refresh_from_db()
+            assert len(profile.activation_key) == 43
+            assert profile.get_activation_key() == activation_key
+
+        user, activated = self.registration_profile.objects.activate_user(
+            hex_keys[0], Site.objects.get_current()
+        )
+        assert activated
+
+        out = StringIO()
+        management.call_command("convertactivationkeys", to="hex", stdout=out)
+        assert "Converted profile count=3" in out.getvalue()
+        keys = RegistrationProfile.objects.values_list("activation_key", flat=True)
+        assert sorted(keys) == sorted(hex_keys)
+
+    def test_resend_activation_email(self):
+        """
+        Test resending activation email to an existing user
+        """
+        user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        assert len(mail.outbox) == 0
+
+        profile = self.registration_profile.objects.get(user=user)
+        orig_activation_key = profile.activation_key
+
+        assert self.registration_profile.objects.resend_activation_mail(
+            email=self.user_info["email"],
+            site=Site.objects.get_current(),
+        )
+
+        profile = self.registration_profile.objects.get(pk=profile.pk)
+        new_activation_key = profile.activation_key
+
+        assert orig_activation_key != new_activation_key
+        assert len(mail.outbox) == 1
+
+    async def test_async_resend_activation_email(self):
+        """
+        ``aresend_activation_mail`` resets the activation key and sends the
+        activation email again.
+
+        """
+        site = await sync_to_async(Site.objects.get_current)()
+        user = await self.registration_profile.objects.acreate_inactive_user(
+            site=site, send_email=False, **self.user_info
+        )
+        profile = await self.registration_profile.objects.aget(user=user)
+
+        assert await self.registration_profile.objects.aresend_activation_mail(
+            email=self.user_info["email"], site=site
+        )
+        assert not await self.registration_profile.objects.aresend_activation_mail(
+            email="bob@example.com", site=site
+        )
+
+        await profile.arefresh_from_db()
+        assert profile.get_activation_key() in mail.outbox[0].body
+        assert len(mail.outbox) == 1
+
+    @override_settings(REGISTRATION_EMAIL_BATCH_SIZE=2)
+    def test_resend_activation_emails(self):
+        """
+        ``resend_activation_mails`` resets the activation keys of the profiles
+        which can still be activated, and sends their emails in batches over
+        one connection each.
+
+        """
+        site = Site.objects.get_current()
+        users = [
+            self.registration_profile.objects.create_inactive_user(
+                site=site,
+                send_email=False,
+                username=username,
+                password="secret",
+                email=f"{username}@example.com",
+            )
+            for username in ("alice", "bob", "carol", "dave")
+        ]
+        expired_user = users[-1]
+        expired_user.date_joined -= timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        expired_user.save()
+        self.sync_expiration_date(expired_user)
+        activation_keys = dict(
+            self.registration_profile.objects.values_list("pk", "activation_key")
+        )
+
+        with mock.patch(
+            "registration.dispatch.get_connection", wraps=mail.get_connection
+        ) as get_connection:
+            sent_count = self.registration_profile.objects.resend_activation_mails(
+                self.registration_profile.objects.with_user(), site
+            )
+        assert sent_count == 3
+        assert get_connection.call_count == 2
+        assert sorted(message.to[0] for message in mail.outbox) == [
+            "alice@example.com",
+            "bob@example.com",
+            "carol@example.com",
+        ]
+        for profile in self.registration_profile.objects.all():
+            if profile.user_id == expired_user.pk:
+                assert profile.activation_key == activation_keys[profile.pk]
+            else:
+                assert profile.activation_key != activation_keys[profile.pk]
+
+    def test_resend_activation_email_cooldown(self):
+        """
+        The activation email is not sent again, nor the profile written,
+        during ``REGISTRATION_RESEND_COOLDOWN`` seconds.
+
+        """
+        user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=user)
+        assert profile.last_sent_at == user.date_joined
+
+        with self.assertNumQueries(1):
+            assert not self.registration_profile.objects.resend_activation_mail(
+                email=self.user_info["email"], site=Site.objects.get_current()
+            )
+        assert len(mail.outbox) == 1
+
+        self.registration_profile.objects.filter(pk=profile.pk).update(
+            last_sent_at=timezone.now() - timedelta(seconds=61)
+        )
+        assert self.registration_profile.objects.resend_activation_mail(
+            email=self.user_info["email"], site=Site.objects.get_current()
+        )
+        assert len(mail.outbox) == 2
+        profile.refresh_from_db()
+        assert profile.last_sent_at > timezone.now() - timedelta(seconds=60)
+
+    def test_resend_activation_email_claimed(self):
+        """
+        A resend which loses the conditional update of ``last_sent_at`` to a
+        concurrent one sends no email.
+
+        """
+        user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=user)
+        self.registration_profile.objects.filter(pk=profile.pk).update(
+            last_sent_at=timezone.now()
+        )
+        with mock.patch.object(
+            self.registration_profile.objects, "_resend_allowed", return_value=True
+        ):
+            assert not self.registration_profile.objects.resend_activation_mail(
+                email=self.user_info["email"], site=Site.objects.get_current()
+            )
+        assert len(mail.outbox) == 0
+        activation_key = profile.activation_key
+        profile.refresh_from_db()
+        assert profile.activation_key == activation_key
+
+    def test_resend_activation_email_query_count(self):
+        """
+        Resending the activation email reads the profile and its user at
+        once, then only updates the activation key.
+
+        """
+        self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        site = Site.objects.get_current()
+        with self.assertNumQueries(self.resend_query_count):
+            assert self.registration_profile.objects.resend_activation_mail(
+                email=self.user_info["email"], site=site
+            )
+        assert len(mail.outbox) == 1
+
+    def test_activation_key_expired_query_count(self):
+        """
+        ``activation_key_expired`` does not need the user of the profile.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        with self.assertNumQueries(0):
+            assert not profile.activation_key_expired()
+
+    @override_settings(REGISTRATION_USER_FIELDS=["first_name"])
+    def test_user_fields(self):
+        """
+        With ``REGISTRATION_USER_FIELDS``, manager lookups only load the
+        listed fields of the user, and the ones the manager needs.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        with CaptureQueriesContext(connection) as queries:
+            user, activated = self.registration_profile.objects.activate_user(
+                profile.activation_key, Site.objects.get_current()
+            )
+        assert activated
+        assert user.get_deferred_fields() == {
+            "password",
+            "last_login",
+            "is_superuser",
+            "last_name",
+            "is_staff",
+            "date_joined",
+        }
+        assert "first_name" in queries[0]["sql"]
+        assert "last_login" not in queries[0]["sql"]
+
+    def test_resend_activation_email_nonexistent_user(self):
+        """
+        Test resending activation email to a nonexisting user
+        """
+        assert not self.registration_profile.objects.resend_activation_mail(
+            email=self.user_info["email"],
+            site=Site.objects.get_current(),
+        )
+
+        assert len(mail.outbox) == 0
+
+    def test_resend_activation_email_activated_user(self):
+        """
+        Test the scenario where user tries to resend activation code
         to the already activated user's email
         """
         user = self.registration_profile.objects.create_inactive_user(
@@ -654,6 +1732,7 @@ class RegistrationModelTests(TransactionTestCase):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         new_user.save()
+        self.sync_expiration_date(new_user)
 
         profile = self.registration_profile.objects.get(user=new_user)
         assert profile.activation_key_expired()
@@ -704,6 +1783,13 @@ class SupervisedRegistrationModelTests(RegistrationModelTests):
     }
 
     registration_profile = SupervisedRegistrationProfile
+    # The site administrators are asked to approve the account.
+    activation_emails_count = 1
+    # The user stays inactive until approved: SELECT, then a single UPDATE.
+    activation_query_count = 2
+    # Updating a child model selects the ids of its rows first: SELECT, then
+    # SELECT and UPDATE.
+    resend_query_count = 3
 
     def test_valid_activation(self):
         """
@@ -893,6 +1979,7 @@ class SupervisedRegistrationModelTests(RegistrationModelTests):
             days=settings.ACCOUNT_ACTIVATION_DAYS + 1
         )
         new_user.save()
+        self.sync_expiration_date(new_user)
         profile = self.registration_profile.objects.get(user=new_user)
         self.registration_profile.objects.activate_user(
             profile.activation_key, Site.objects.get_current()
@@ -996,6 +2083,164 @@ class SupervisedRegistrationModelTests(RegistrationModelTests):
         assert isinstance(user, User)
         assert user.is_active
 
+    async def test_async_admin_approval(self):
+        """
+        ``aadmin_approve_user`` activates the user once they activated their
+        profile.
+
+        """
+        site = await sync_to_async(Site.objects.get_current)()
+        new_user = await self.registration_profile.objects.acreate_inactive_user(
+            site=site, **self.user_info
+        )
+        profile = await self.registration_profile.objects.aget(user=new_user)
+        assert not await self.registration_profile.objects.aadmin_approve_user(
+            profile.id, site
+        )
+
+        await self.registration_profile.objects.aactivate_user(
+            profile.activation_key, site
+        )
+        user = await self.registration_profile.objects.aadmin_approve_user(
+            profile.id, site
+        )
+        assert user.is_active
+        await new_user.arefresh_from_db()
+        assert new_user.is_active
+        assert not await self.registration_profile.objects.aadmin_approve_user(0, site)
+
+    def test_admin_approval_query_count(self):
+        """
+        Approving a user reads the profile and its user at once, then only
+        updates ``User.is_active`` and the approval date of the profile.
+
+        """
+        new_user = self.registration_profile.objects.create_inactive_user(
+            site=Site.objects.get_current(), send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=new_user)
+        self.registration_profile.objects.activate_user(
+            profile.activation_key, Site.objects.get_current()
+        )
+        site = Site.objects.get_current()
+        with self.assertNumQueries(3):
+            user = self.registration_profile.objects.admin_approve_user(
+                profile.id, site
+            )
+        assert user.is_active
+
+    @override_settings(REGISTRATION_ADMIN_APPROVAL_DIGEST=True)
+    def test_admin_approval_digest(self):
+        """
+        With ``REGISTRATION_ADMIN_APPROVAL_DIGEST``, activations do not email
+        the admins; the ``sendapprovaldigest`` command sends each of them
+        one email listing the accounts awaiting approval.
+
+        """
+        site = Site.objects.get_current()
+        profiles = []
+        for username in ("alice", "bob", "carol"):
+            user = self.registration_profile.objects.create_inactive_user(
+                site=site,
+                send_email=False,
+                username=username,
+                password="secret",
+                email=f"{username}@example.com",
+            )
+            profiles.append(self.registration_profile.objects.get(user=user))
+        for profile in profiles[:2]:
+            self.registration_profile.objects.activate_user(
+                profile.activation_key, site
+            )
+        assert len(mail.outbox) == 0
+
+        out = StringIO()
+        management.call_command("sendapprovaldigest", stdout=out)
+        assert "Awaiting approval count=2" in out.getvalue()
+        assert [message.to for message in mail.outbox] == [
+            [admin[1]] for admin in settings.REGISTRATION_ADMINS
+        ]
+        body = mail.outbox[0].body
+        assert "alice" in body and "bob" in body and "carol" not in body
+        assert reverse("registration_admin_approve", args=(profiles[0].id,)) in body
+
+        self.registration_profile.objects.admin_approve_user(profiles[0].id, site)
+        mail.outbox.clear()
+        assert self.registration_profile.objects.send_admin_approve_digest(site) == 1
+        assert "alice" not in mail.outbox[0].body
+
+        self.registration_profile.objects.admin_approve_user(profiles[1].id, site)
+        mail.outbox.clear()
+        assert self.registration_profile.objects.send_admin_approve_digest(site) == 0
+        assert len(mail.outbox) == 0
+
+        # Users deactivated once approved do not await approval again.
+        get_user_model().objects.update(is_active=False)
+        assert self.registration_profile.objects.send_admin_approve_digest(site) == 0
+
+    @override_settings(
+        REGISTRATION_ADMIN_APPROVAL_DIGEST=True,
+        REGISTRATION_ADMIN_APPROVAL_DIGEST_LIMIT=2,
+    )
+    def test_admin_approval_digest_limit(self):
+        """
+        The digest lists ``REGISTRATION_ADMIN_APPROVAL_DIGEST_LIMIT``
+        accounts, and counts the others.
+
+        """
+        site = Site.objects.get_current()
+        for username in ("alice", "bob", "carol"):
+            user = self.registration_profile.objects.create_inactive_user(
+                site=site,
+                send_email=False,
+                username=username,
+                password="secret",
+                email=f"{username}@example.com",
+            )
+            profile = self.registration_profile.objects.get(user=user)
+            self.registration_profile.objects.activate_user(
+                profile.activation_key, site
+            )
+
+        assert self.registration_profile.objects.send_admin_approve_digest(site) == 3
+        body = mail.outbox[0].body
+        assert "alice" in body and "bob" in body and "carol" not in body
+        assert "And 1 more user." in body
+        assert "And 1 more user." in mail.outbox[0].alternatives[0][0]
+
+    def test_backfill_approved_at_migration(self):
+        """
+        The ``0015_backfill_approved_at`` migration marks the accounts
+        already approved.
+
+        """
+        site = Site.objects.get_current()
+        user = self.registration_profile.objects.create_inactive_user(
+            site=site, send_email=False, **self.user_info
+        )
+        profile = self.registration_profile.objects.get(user=user)
+        self.registration_profile.objects.activate_user(profile.activation_key, site)
+        self.registration_profile.objects.admin_approve_user(profile.id, site)
+        self.registration_profile.objects.update(approved_at=None)
+
+        migration = import_module("registration.migrations.0015_backfill_approved_at")
+        with connection.schema_editor() as schema_editor:
+            migration.backfill_approved_at(apps, schema_editor)
+
+        assert self.registration_profile.objects.get().approved_at is not None
+
+    def test_admin_approval_digest_domain(self):
+        """
+        Without ``django.contrib.sites``, ``sendapprovaldigest`` links to
+        the ``--domain`` given.
+
+        """
+        with mock.patch("django.apps.apps.is_installed", return_value=False):
+            site = get_site("example.org")
+            with pytest.raises(management.CommandError):
+                get_site()
+        assert site.domain == "example.org"
+
     def test_admin_approval_not_activated(self):
         """
         Approving a non activated user's account fails
@@ -1100,3 +2345,603 @@ class SupervisedRegistrationModelTests(RegistrationModelTests):
              REGISTRATION_ADMINS"""
             assert len(_warning) > 0, assertion_error
             assert "REGISTRATION_ADMINS" in str(_warning[-1].message), assertion_error
+
+
+@override_settings(
+    ACCOUNT_ACTIVATION_DAYS=7,
+    REGISTRATION_DEFAULT_FROM_EMAIL="registration@email.com",
+    REGISTRATION_EMAIL_DELIVERY="outbox",
+)
+class OutboxEmailTests(TransactionTestCase):
+    """
+    Test the email outbox and the ``registration_mailworker`` command.
+
+    """
+
+    user_info = {
+        "username": "alice",
+        "password": "swordfish",
+        "email": "alice@example.com",
+    }
+
+    def test_activation_email_queued(self):
+        """
+        The activation email is written to the outbox with the profile,
+        and not sent.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        assert len(mail.outbox) == 0
+        email = OutboxEmail.objects.get()
+        assert email.to == ["alice@example.com"]
+        assert email.from_email == "registration@email.com"
+        assert email.html_body
+
+        with pytest.raises(IntegrityError):
+            with transaction.atomic():
+                RegistrationProfile.objects.create_inactive_user(
+                    site=Site.objects.get_current(),
+                    username="bob",
+                    password="secret",
+                    email="bob@example.com",
+                )
+                raise IntegrityError
+        assert OutboxEmail.objects.count() == 1
+
+    def test_resend_activation_emails_queued(self):
+        """
+        Emails resent together are written to the outbox together.
+
+        """
+        site = Site.objects.get_current()
+        for username in ("alice", "bob"):
+            RegistrationProfile.objects.create_inactive_user(
+                site=site,
+                send_email=False,
+                username=username,
+                password="secret",
+                email=f"{username}@example.com",
+            )
+        email_messages = [
+            profile.get_activation_email(site)
+            for profile in RegistrationProfile.objects.with_user()
+        ]
+        # A single INSERT, wrapped in BEGIN/COMMIT.
+        with self.assertNumQueries(3):
+            OutboxEmail.objects.enqueue_many(email_messages)
+        assert RegistrationProfile.objects.resend_activation_mails(
+            RegistrationProfile.objects.with_user(), site
+        )
+        assert OutboxEmail.objects.count() == 4
+        assert len(mail.outbox) == 0
+
+    def test_mailworker(self):
+        """
+        ``registration_mailworker`` sends the queued emails once.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        out = StringIO()
+        management.call_command("registration_mailworker", once=True, stdout=out)
+        assert "Sent email count=1" in out.getvalue()
+        assert len(mail.outbox) == 1
+        assert mail.outbox[0].to == ["alice@example.com"]
+        assert mail.outbox[0].alternatives[0][1] == "text/html"
+
+        email = OutboxEmail.objects.get()
+        assert email.sent_at is not None
+        assert email.attempts == 1
+
+        management.call_command("registration_mailworker", once=True, stdout=out)
+        assert len(mail.outbox) == 1
+
+    def test_mailworker_lanes(self):
+        """
+        Activation emails are sent before notifications, and
+        ``registration_mailworker --lane`` only sends the emails of a lane.
+
+        """
+        site = Site.objects.get_current()
+        user = SupervisedRegistrationProfile.objects.create_inactive_user(
+            site=site, send_email=False, **self.user_info
+        )
+        SupervisedRegistrationProfile.objects.send_admin_approve_email(user, site)
+        RegistrationProfile.objects.resend_activation_mails(
+            RegistrationProfile.objects.with_user(), site
+        )
+        assert [email.priority for email in OutboxEmail.objects.due(5)] == [0, 1]
+
+        out = StringIO()
+        management.call_command(
+            "registration_mailworker", once=True, lane="notification", stdout=out
+        )
+        assert "Sent email count=1" in out.getvalue()
+        assert len(mail.outbox) == 1
+        assert mail.outbox[0].to == [
+            "registration_admin1@mail.server.com",
+            "registration_admin2@mail.server.com",
+        ]
+        assert [email.priority for email in OutboxEmail.objects.due(5)] == [0]
+
+    def test_mailworker_retries(self):
+        """
+        Emails which fail to be sent are retried after a backoff, until the
+        maximum number of attempts is reached.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        out = StringIO()
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=ConnectionRefusedError,
+        ):
+            management.call_command("registration_mailworker", once=True, stdout=out)
+            email = OutboxEmail.objects.get()
+            assert email.attempts == 1
+            assert "ConnectionRefusedError" in email.last_error
+            assert email.next_attempt_at > timezone.now() + timedelta(seconds=50)
+
+            management.call_command(
+                "registration_mailworker",
+                once=True,
+                backoff=0,
+                max_attempts=3,
+                stdout=out,
+            )
+        email.refresh_from_db()
+        assert email.attempts == 1
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=ConnectionRefusedError,
+        ):
+            management.call_command(
+                "registration_mailworker",
+                once=True,
+                backoff=0,
+                max_attempts=3,
+                stdout=out,
+            )
+        email.refresh_from_db()
+        assert email.attempts == 3
+        assert email.sent_at is None
+        assert len(mail.outbox) == 0
+
+    def test_mailworker_lease(self):
+        """
+        Emails are claimed for ``--lease`` seconds in a transaction of their
+        own, and sent outside of it.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        claims = []
+
+        def send_messages(email_messages):
+            claims.append(
+                (connection.in_atomic_block, OutboxEmail.objects.get().next_attempt_at)
+            )
+            return len(email_messages)
+
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=send_messages,
+        ):
+            management.call_command(
+                "registration_mailworker", once=True, lease=600, stdout=StringIO()
+            )
+        [(in_atomic_block, leased_until)] = claims
+        assert not in_atomic_block
+        assert leased_until > timezone.now() + timedelta(seconds=590)
+        email = OutboxEmail.objects.get()
+        assert email.attempts == 1
+        assert email.sent_at is not None
+
+    def test_mailworker_connection_error(self):
+        """
+        An error opening the connection is logged, and the emails are still
+        sent, or retried.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(), **self.user_info
+        )
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.open",
+            side_effect=smtplib.SMTPConnectError(421, "Unavailable"),
+        ):
+            with self.assertLogs(
+                "registration.management.commands.registration_mailworker", "ERROR"
+            ):
+                management.call_command(
+                    "registration_mailworker", once=True, stdout=StringIO()
+                )
+        assert len(mail.outbox) == 1
+
+
+@override_settings(
+    ACCOUNT_ACTIVATION_DAYS=7,
+    REGISTRATION_EMAIL_DELIVERY="thread",
+)
+class EmailDispatcherTests(TransactionTestCase):
+    """
+    Test the in-process email dispatcher.
+
+    """
+
+    def setUp(self):
+        self.dispatcher = get_email_dispatcher()
+        self.dispatcher.drain()
+        self.sent_count = self.dispatcher.sent_count
+        self.failed_count = self.dispatcher.failed_count
+        self.rejected_count = self.dispatcher.rejected_count
+
+    def test_activation_email_dispatched(self):
+        """
+        The activation email is sent by the dispatcher.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            username="alice",
+            password="swordfish",
+            email="alice@example.com",
+        )
+        self.dispatcher.drain()
+        assert self.dispatcher.queue_depth == 0
+        assert self.dispatcher.sent_count == self.sent_count + 1
+        assert len(mail.outbox) == 1
+        assert mail.outbox[0].to == ["alice@example.com"]
+
+    def test_dispatch_failure(self):
+        """
+        Emails which fail to be sent are counted.
+
+        """
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=ConnectionRefusedError,
+        ):
+            assert self.dispatcher.submit([mail.EmailMessage(to=["a@example.com"])])
+            self.dispatcher.drain()
+        assert self.dispatcher.failed_count == self.failed_count + 1
+        assert self.dispatcher.queue_depth == 0
+
+    def test_dispatch_lanes(self):
+        """
+        Activation and admin emails are sent by the dispatchers of their
+        lanes.
+
+        """
+        notification_dispatcher = get_email_dispatcher(NOTIFICATION_LANE)
+        notification_dispatcher.drain()
+        sent_count = notification_dispatcher.sent_count
+        site = Site.objects.get_current()
+        user = SupervisedRegistrationProfile.objects.create_inactive_user(
+            site=site,
+            username="alice",
+            password="swordfish",
+            email="alice@example.com",
+        )
+        SupervisedRegistrationProfile.objects.activate_user(
+            user.registrationprofile.activation_key, site
+        )
+        self.dispatcher.drain()
+        notification_dispatcher.drain()
+        assert self.dispatcher.sent_count == self.sent_count + 1
+        assert notification_dispatcher.sent_count == sent_count + 1
+        assert len(mail.outbox) == 2
+
+    @override_settings(REGISTRATION_EMAIL_QUEUE_SIZE=0)
+    def test_dispatch_queue_full(self):
+        """
+        Emails are sent inline once the queue is full.
+
+        """
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            username="alice",
+            password="swordfish",
+            email="alice@example.com",
+        )
+        assert len(mail.outbox) == 1
+        assert self.dispatcher.rejected_count == self.rejected_count + 1
+        assert self.dispatcher.sent_count == self.sent_count
+
+
+@override_settings(ACCOUNT_ACTIVATION_DAYS=7)
+class EmailInstrumentationTests(TransactionTestCase):
+    """
+    Test the signals sent when registration emails are rendered and sent.
+
+    """
+
+    def setUp(self):
+        self.rendered = []
+        self.sent = []
+
+        def on_rendered(sender, **kwargs):
+            self.rendered.append(kwargs)
+
+        def on_sent(sender, **kwargs):
+            self.sent.append(kwargs)
+
+        signals.email_rendered.connect(on_rendered)
+        signals.email_sent.connect(on_sent)
+        self.addCleanup(signals.email_rendered.disconnect, on_rendered)
+        self.addCleanup(signals.email_sent.disconnect, on_sent)
+
+    def create_inactive_user(self):
+        return RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            username="alice",
+            password="swordfish",
+            email="alice@example.com",
+        )
+
+    def test_email_instrumented(self):
+        """
+        Rendering and sending an email report its template, duration and
+        size.
+
+        """
+        self.create_inactive_user()
+        assert len(mail.outbox) == 1
+        assert len(self.rendered) == 1
+        assert self.rendered[0]["template_name"] == "registration/activation_email.txt"
+        assert self.rendered[0]["duration"] >= 0
+        assert len(self.sent) == 1
+        assert self.sent[0]["template_name"] == "registration/activation_email.txt"
+        assert self.sent[0]["duration"] >= 0
+        assert self.sent[0]["size"] > len(mail.outbox[0].body)
+        assert self.sent[0]["exception"] is None
+
+    def test_email_failure_instrumented(self):
+        """
+        An email which fails to be sent reports the exception raised.
+
+        """
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=ConnectionRefusedError,
+        ):
+            with pytest.raises(ConnectionRefusedError):
+                self.create_inactive_user()
+        assert len(self.sent) == 1
+        assert isinstance(self.sent[0]["exception"], ConnectionRefusedError)
+
+    @override_settings(REGISTRATION_EMAIL_DELIVERY="outbox")
+    def test_queued_email_instrumented(self):
+        """
+        Emails sent by the mail worker keep the name of their template.
+
+        """
+        self.create_inactive_user()
+        assert self.sent == []
+        management.call_command("registration_mailworker", once=True, stdout=StringIO())
+        assert len(self.sent) == 1
+        assert self.sent[0]["template_name"] == "registration/activation_email.txt"
+
+
+@override_settings(ACCOUNT_ACTIVATION_DAYS=7)
+class LoadTestTests(TransactionTestCase):
+    """
+    Test the local SMTP sink and the load test command.
+
+    """
+
+    def get_connection(self, sink):
+        return mail.get_connection(
+            "django.core.mail.backends.smtp.EmailBackend",
+            host=sink.host,
+            port=sink.port,
+        )
+
+    def test_smtp_sink(self):
+        """
+        The SMTP sink accepts emails, or refuses them at the failure rate.
+
+        """
+        email_message = mail.EmailMessage("Subject", "Body", to=["a@example.com"])
+        with SMTPSink() as sink:
+            assert self.get_connection(sink).send_messages([email_message]) == 1
+        assert sink.message_count == 1
+
+        with SMTPSink(failure_rate=1) as sink:
+            with pytest.raises(smtplib.SMTPDataError):
+                self.get_connection(sink).send_messages([email_message])
+        assert sink.failure_count == 1
+
+    def test_use_email_connection(self):
+        """
+        ``use_email_connection`` sends the registration emails with another
+        backend within its block only.
+
+        """
+        email_message = mail.EmailMessage("Subject", "Body", to=["a@example.com"])
+        with SMTPSink() as sink:
+            with use_email_connection(
+                "django.core.mail.backends.smtp.EmailBackend",
+                host=sink.host,
+                port=sink.port,
+            ):
+                send_messages([email_message])
+            send_messages([email_message])
+        assert sink.message_count == 1
+        assert len(mail.outbox) == 1
+
+    def test_loadtest(self):
+        """
+        The load test command registers, activates and approves the users,
+        reports the throughput and deletes the users.
+
+        """
+        out = StringIO()
+        management.call_command(
+            "registration_loadtest", count=3, flow="admin_approval", stdout=out
+        )
+        output = out.getvalue()
+        assert "Registrations: count=3, failed=0" in output
+        # The activation, admin approval and approval complete emails.
+        assert "Emails: sent=9, refused=0" in output
+        assert not get_user_model().objects.exists()
+
+    def test_loadtest_domain(self):
+        """
+        Without ``django.contrib.sites``, the load test command requires the
+        ``--domain`` of the activation links.
+
+        """
+        out = StringIO()
+        with mock.patch("django.apps.apps.is_installed", return_value=False):
+            with pytest.raises(management.CommandError):
+                management.call_command("registration_loadtest", count=1, stdout=out)
+            management.call_command(
+                "registration_loadtest", count=1, domain="example.org", stdout=out
+            )
+        assert "Registrations: count=1, failed=0" in out.getvalue()
+        assert not get_user_model().objects.exists()
+
+    @override_settings(REGISTRATION_EMAIL_DELIVERY="outbox")
+    def test_loadtest_outbox_retries(self):
+        """
+        The load test command reports the outbox retries.
+
+        """
+        out = StringIO()
+        management.call_command(
+            "registration_loadtest",
+            count=2,
+            failure_rate=1,
+            max_attempts=3,
+            stdout=out,
+        )
+        output = out.getvalue()
+        assert "Outbox: retried=2, given up=2, attempts=6" in output
+        assert "Email failures: SMTPDataError=6" in output
+        assert not OutboxEmail.objects.exists()
+
+
+@override_settings(ACCOUNT_ACTIVATION_DAYS=7)
+class ParallelCleanupTests(TransactionTestCase):
+    """
+    Test ``cleanupregistration --workers``.
+
+    """
+
+    def test_split_range(self):
+        """
+        The ids are split into ranges of the same width.
+
+        """
+        assert split_range(1, 10, 3) == [(1, 4), (5, 8), (9, 10)]
+        assert split_range(5, 5, 4) == [(5, 5)]
+
+    def test_workers(self):
+        """
+        Each worker deletes the expired users of its range of ids.
+
+        """
+        site = Site.objects.get_current()
+        for i in range(5):
+            RegistrationProfile.objects.create_inactive_user(
+                site=site,
+                activation_window=datetime.timedelta(0),
+                username=f"expired{i}",
+                password="secret",
+                email=f"expired{i}@example.com",
+            )
+        RegistrationProfile.objects.create_inactive_user(
+            site=site, username="alice", password="secret", email="alice@example.com"
+        )
+
+        out = StringIO()
+        err = StringIO()
+        management.call_command(
+            "cleanupregistration",
+            workers=2,
+            database="default",
+            stdout=out,
+            stderr=err,
+        )
+        assert "SQLite accepts a single writer" in err.getvalue()
+        output = out.getvalue()
+        assert output.count("Deleted range") == 2
+        assert "Deleted user count=5" in output
+        assert RegistrationProfile.objects.get().user.username == "alice"
+
+    def test_workers_pool(self):
+        """
+        The pool of workers deletes each range once, ids at the bounds of
+        the ranges included.
+
+        """
+        site = Site.objects.get_current()
+        for i in range(7):
+            RegistrationProfile.objects.create_inactive_user(
+                site=site,
+                activation_window=datetime.timedelta(0),
+                username=f"expired{i}",
+                password="secret",
+                email=f"expired{i}@example.com",
+            )
+        RegistrationProfile.objects.create_inactive_user(
+            site=site, username="alice", password="secret", email="alice@example.com"
+        )
+        expired_pks = sorted(
+            RegistrationProfile.objects.expired().values_list("pk", flat=True)
+        )
+        ranges = split_range(expired_pks[0], expired_pks[-1], 3)
+        assert len(ranges) == 3
+
+        # Processes do not share the in-memory test database: the pool runs
+        # threads, which SQLite lets write one at a time.
+        lock = threading.Lock()
+        deleted = {}
+        original_delete_range = cleanupregistration.delete_range
+
+        def delete_range(database, batch_size, min_pk, max_pk, deadline, sleep):
+            with lock:
+                deleted[min_pk, max_pk] = list(
+                    RegistrationProfile.objects.filter(
+                        pk__gte=min_pk, pk__lte=max_pk
+                    ).values_list("pk", flat=True)
+                )
+                return original_delete_range(
+                    database, batch_size, min_pk, max_pk, deadline, sleep
+                )
+
+        def executor(max_workers, initializer):
+            assert max_workers == 3
+            return ThreadPoolExecutor(max_workers, initializer=initializer)
+
+        with mock.patch.object(connection, "vendor", "postgresql"), mock.patch.object(
+            cleanupregistration, "ProcessPoolExecutor", side_effect=executor
+        ), mock.patch.object(
+            cleanupregistration, "delete_range", side_effect=delete_range
+        ):
+            result = management.call_command(
+                "cleanupregistration", workers=3, json=True, stdout=StringIO()
+            )
+        assert sorted(deleted) == ranges
+        assert sorted(pk for pks in deleted.values() for pk in pks) == expired_pks
+        assert json.loads(result)["deleted_count"] == 7
+        assert RegistrationProfile.objects.get().user.username == "alice"
+
+    def test_workers_archive(self):
+        """
+        ``--archive`` cannot be used with ``--workers``.
+
+        """
+        with pytest.raises(management.CommandError):
+            management.call_command(
+                "cleanupregistration", workers=2, archive="registrations.jsonl"
+            )
@@ -4,6 +4,7 @@ Views which allow users to create and activate accounts.
 """
 
 from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import ImproperlyConfigured
 from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
@@ -12,8 +13,15 @@ from django.views.decorators.debug import sensitive_post_parameters
 from django.views.generic import FormView
 from django.views.generic import TemplateView
 
+from asgiref.sync import sync_to_async
 from formtools.wizard.views import SessionWizardView
 
+from .cache import aallow_resend_activation
+from .cache import aget_activation_outcome
+from .cache import allow_resend_activation
+from .cache import aremember_activation_outcome
+from .cache import get_activation_outcome
+from .cache import remember_activation_outcome
 from .forms import ResendActivationForm
 
 REGISTRATION_FORM_PATH = getattr(
@@ -140,15 +148,40 @@ class BaseActivationView(TemplateView):
     template_name = "registration/activate.html"
 
     def get(self, request, *args, **kwargs):
-        if activated_user := self.activate(*args, **kwargs):
-            success_url = self.get_success_url(activated_user)
-            try:
-                to, args, kwargs = success_url
-            except ValueError:
-                return redirect(success_url)
-            else:
-                return redirect(to, *args, **kwargs)
-        return super().get(request, *args, **kwargs)
+        # The outcome of the activation is cached, so that requesting the
+        # activation link again does not touch the database.
+        activation_key = kwargs.get("activation_key", "")
+        outcome = get_activation_outcome(activation_key)
+        if outcome is None:
+            outcome = self.get_activation_outcome(self.activate(*args, **kwargs))
+            remember_activation_outcome(activation_key, outcome)
+        return self.render_activation_outcome(outcome, *args, **kwargs)
+
+    def get_activation_outcome(self, activated_user):
+        """
+        Return the URL to redirect to after activating ``activated_user``, or
+        an empty string if the activation failed.
+
+        """
+        if not activated_user:
+            return ""
+        success_url = self.get_success_url(activated_user)
+        try:
+            to, redirect_args, redirect_kwargs = success_url
+        except ValueError:
+            return redirect(success_url).url
+        else:
+            return redirect(to, *redirect_args, **redirect_kwargs).url
+
+    def render_activation_outcome(self, outcome, *args, **kwargs):
+        """
+        Redirect to the URL ``outcome``, or render the template when the
+        activation failed.
+
+        """
+        if outcome:
+            return redirect(outcome)
+        return super().get(self.request, *args, **kwargs)
 
     def activate(self, *args, **kwargs):
         """
@@ -161,6 +194,28 @@ class BaseActivationView(TemplateView):
         raise NotImplementedError
 
 
+class BaseAsyncActivationView(BaseActivationView):
+    """
+    Base class for user activation views served asynchronously.
+
+    """
+
+    async def get(self, request, *args, **kwargs):
+        activation_key = kwargs.get("activation_key", "")
+        outcome = await aget_activation_outcome(activation_key)
+        if outcome is None:
+            outcome = self.get_activation_outcome(await self.aactivate(*args, **kwargs))
+            await aremember_activation_outcome(activation_key, outcome)
+        return self.render_activation_outcome(outcome, *args, **kwargs)
+
+    async def aactivate(self, *args, **kwargs):
+        """
+        Implement asynchronous account-activation logic here.
+
+        """
+        raise NotImplementedError
+
+
 class BaseResendActivationView(FormView):
     """
     Base class for resending activation views.
@@ -175,9 +230,21 @@ class BaseResendActivationView(FormView):
         confirmation template.
 
         """
-        self.resend_activation(form)
+        if self.resend_allowed(form):
+            self.resend_activation(form)
         return self.render_form_submitted_template(form)
 
+    def resend_allowed(self, form):
+        """
+        Return whether the activation email may be sent again, according to
+        the rate limits per email address and per client IP address (see
+        ``REGISTRATION_RESEND_RATE``).
+
+        """
+        return allow_resend_activation(
+            form.cleaned_data["email"], self.request.META.get("REMOTE_ADDR", "")
+        )
+
     def resend_activation(self, form):
         """
         Implement resend activation key logic here.
@@ -192,12 +259,57 @@ class BaseResendActivationView(FormView):
         raise NotImplementedError
 
 
+class BaseAsyncResendActivationView(BaseResendActivationView):
+    """
+    Base class for resending activation views served asynchronously.
+
+    """
+
+    async def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not form.is_valid():
+            return self.form_invalid(form)
+        if await self.aresend_allowed(form):
+            await self.aresend_activation(form)
+        # The template may use the session or the user of the request.
+        return await sync_to_async(self.render_form_submitted_template)(form)
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
+    async def aresend_allowed(self, form):
+        """
+        Asynchronous version of ``resend_allowed``.
+
+        """
+        return await aallow_resend_activation(
+            form.cleaned_data["email"], self.request.META.get("REMOTE_ADDR", "")
+        )
+
+    async def aresend_activation(self, form):
+        """
+        Implement asynchronous resend activation key logic here.
+        """
+        raise NotImplementedError
+
+
 class BaseApprovalView(TemplateView):
     http_method_names = ["get"]
     template_name = "registration/admin_approve.html"
 
     def get(self, request, *args, **kwargs):
-        if approved_user := self.approve(*args, **kwargs):
+        return self.render_approval(self.approve(*args, **kwargs), *args, **kwargs)
+
+    def render_approval(self, approved_user, *args, **kwargs):
+        """
+        Redirect to the success URL once ``approved_user`` is approved, or
+        render the template when the approval failed.
+
+        """
+        if approved_user:
             success_url = self.get_success_url(approved_user)
             try:
                 to, args, kwargs = success_url
@@ -205,7 +317,7 @@ class BaseApprovalView(TemplateView):
                 return redirect(success_url)
             else:
                 return redirect(to, *args, **kwargs)
-        return super().get(request, *args, **kwargs)
+        return super().get(self.request, *args, **kwargs)
 
     def approve(self, *args, **kwargs):
         """
@@ -216,3 +328,39 @@ class BaseApprovalView(TemplateView):
 
     def get_success_url(self, user):
         raise NotImplementedError
+
+
+class BaseAsyncApprovalView(BaseApprovalView):
+    """
+    Base class for admin approval views served asynchronously.
+
+    Django's ``permission_required`` decorator cannot wrap a coroutine view
+    in Django 4.2, so the view checks itself that the user has
+    ``permission_required``, as the URLconf of the admin approval backend
+    does for the synchronous view, and redirects to the login page
+    otherwise.
+
+    """
+
+    permission_required = "is_superuser"
+
+    async def get(self, request, *args, **kwargs):
+        # Loading the user of the session queries the database.
+        if not await sync_to_async(self.has_permission)():
+            return redirect_to_login(request.get_full_path())
+        approved_user = await self.aapprove(*args, **kwargs)
+        return self.render_approval(approved_user, *args, **kwargs)
+
+    def has_permission(self):
+        """
+        Return whether the user of the request may approve accounts.
+
+        """
+        return self.request.user.has_perm(self.permission_required)
+
+    async def aapprove(self, *args, **kwargs):
+        """
+        Implement asynchronous admin-approval logic here.
+
+        """
+        raise NotImplementedError